@@ -1,6 +1,7 @@
 import sys    
 import os
 import math
+from collections import OrderedDict
 from pathlib import Path
 from PIL import Image, ImageOps, ImagePalette
 import numpy as np
@@ -36,54 +37,157 @@ HORIZONTAL = 0
 VERTICAL = 1
 HORIZONTAL_AND_VERTICAL = 2
 
+#Decode cache memory budget in bytes
+DECODE_CACHE_BUDGET = 256*1024*1024
+QUANTIZE_CHUNK_SIZE = 4096
+
+#Bits per pixel for each PXL mode
+PXL_MODE_BITS = {ONE_BIT: 1,
+                 TWO_BIT: 2,
+                 FOUR_BIT: 4,
+                 EIGHT_BIT: 8,
+                 FIFTEEN_BIT_DIRECT: 16,
+                 SIXTEEN_BIT_PS1_DIRECT: 16,
+                 TWENTY_FOUR_BIT_DIRECT: 24,
+                 THIRTY_TWO_BIT_DIRECT: 32,
+                 THIRTY_TWO_BIT_PS2_DIRECT: 32}
+
 def readPXL(file, offset, width, height, mode, inset=-1):
+    #Returns a (height, width) array of CLUT indices or packed direct color values
+    bits = PXL_MODE_BITS[mode]
+    row_bytes = (width*bits + 7)//8
+    stride = row_bytes
+    if inset != -1:
+        stride += inset #Skip inset bytes if horizontally stacked image
+
+    total_bytes = 0
+    if height > 0:
+        total_bytes = stride*(height - 1) + row_bytes
+
     file.seek(offset)
-    buffer = []
-    if mode == EIGHT_BIT:
-        #buffer = list(file.read(width*height))
-        for y in range(height):
-            buffer += list(file.read(width))
-            
-            if inset != -1:
-                file.read(inset) #Skip inset bytes if horizontally stacked image
-    elif mode == TWO_BIT:
-        for y in range(height):
-            for x in range(width//2):
-                next_byte = int.from_bytes(file.read(1), "little")
-                buffer.append(next_byte&0b11)
-                buffer.append((next_byte&0b1100)>>2)
-                buffer.append((next_byte&0b110000)>>4)
-                buffer.append((next_byte&0b11000000)>>6)
-            if inset != -1:
-                file.read(inset) #Skip inset bytes if horizontally stacked image
-    elif mode == FOUR_BIT:
-        for y in range(height):
-            for x in range(width//2):
-                next_byte = int.from_bytes(file.read(1), "little")
-                buffer.append(next_byte&0b1111)
-                buffer.append((next_byte&0b11110000)>>4)
-            if inset != -1:
-                file.read(inset) #Skip inset bytes if horizontally stacked image
-    elif mode == SIXTEEN_BIT_PS1_DIRECT or mode == FIFTEEN_BIT_DIRECT:
-        for y in range(height):
-            for x in range(width):
-                buffer.append(int.from_bytes(file.read(2), "little"))
-            if inset != -1:
-                file.read(inset) #Skip inset bytes if horizontally stacked image
-                
-    elif mode == TWENTY_FOUR_BIT_DIRECT:
-        for y in range(height):
-            for x in range(width):
-                buffer.append(int.from_bytes(file.read(3), "little"))
-            if inset != -1:
-                file.read(inset) #Skip inset bytes if horizontally stacked image
-    elif mode == THIRTY_TWO_BIT_PS2_DIRECT:
-        for y in range(height):
-            for x in range(width):
-                buffer.append(int.from_bytes(file.read(4), "little"))
-            if inset != -1:
-                file.read(inset) #Skip inset bytes if horizontally stacked image
-    return buffer
+    data = file.read(total_bytes)
+    if len(data) < total_bytes:
+        data = data + bytes(total_bytes - len(data))
+
+    if bits == 24:
+        #View each row's pixels as 3 byte groups, skipping the inset via the row stride
+        channels = np.ndarray((height, width, 3), dtype=np.uint8, buffer=data, strides=(stride, 3, 1)).astype(np.uint32)
+        return channels[:, :, 0] | (channels[:, :, 1] << 8) | (channels[:, :, 2] << 16)
+    elif bits >= 8:
+        dtype = np.dtype("<u" + str(bits//8))
+        return np.ndarray((height, width), dtype=dtype, buffer=data, strides=(stride, dtype.itemsize))
+
+    #Sub-byte modes are packed with the leftmost pixel in the lowest bits
+    rows = np.ndarray((height, row_bytes), dtype=np.uint8, buffer=data, strides=(stride, 1))
+    pixels_per_byte = 8//bits
+    shifts = np.arange(pixels_per_byte, dtype=np.uint8)*bits
+    pixels = (rows[:, :, np.newaxis] >> shifts) & ((1 << bits) - 1)
+    return pixels.reshape((height, row_bytes*pixels_per_byte))[:, :width]
+
+def packPXL(pixels, mode):
+    #Inverse of readPXL, returns the (height, row_bytes) bytes of a pixel array
+    bits = PXL_MODE_BITS[mode]
+    height, width = pixels.shape
+
+    if bits == 24:
+        pixels = pixels.astype(np.uint32)
+        channels = np.stack([pixels & 0xFF, (pixels >> 8) & 0xFF, (pixels >> 16) & 0xFF], axis=2)
+        return channels.astype(np.uint8).reshape((height, width*3))
+    elif bits >= 8:
+        dtype = np.dtype("<u" + str(bits//8))
+        return np.ascontiguousarray(pixels, dtype=dtype).view(np.uint8).reshape((height, width*dtype.itemsize))
+
+    pixels_per_byte = 8//bits
+    groups = pixels.astype(np.uint8).reshape((height, width//pixels_per_byte, pixels_per_byte))
+    packed = np.zeros((height, width//pixels_per_byte), dtype=np.uint8)
+    for pixel_number in range(pixels_per_byte):
+        packed |= (groups[:, :, pixel_number] & ((1 << bits) - 1)) << (pixel_number*bits)
+    return packed
+
+def writePXL(file, offset, rows, inset=-1):
+    #Writes packed rows in one call, or one call per row when an inset separates them
+    if inset <= 0:
+        file.seek(offset)
+        file.write(rows.tobytes())
+        return
+
+    stride = rows.shape[1] + inset
+    for row_number in range(rows.shape[0]):
+        file.seek(offset + row_number*stride)
+        file.write(rows[row_number].tobytes())
+
+class DecodeCache:
+    #Process-wide LRU cache of decoded PXL/CLT data keyed by (path, offset, kind, mtime, size)
+    def __init__(self, budget=DECODE_CACHE_BUDGET):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.total_size = 0
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        if key in self.entries:
+            self.remove(key)
+        size = getCacheSize(value)
+        if size > self.budget:
+            return
+        self.entries[key] = value
+        self.sizes[key] = size
+        self.total_size += size
+
+        #Evict least recently used entries until back under budget
+        while self.total_size > self.budget:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        del self.entries[key]
+        self.total_size -= self.sizes.pop(key)
+
+    def invalidate(self, path):
+        path = os.path.abspath(path)
+        for key in [key for key in self.entries if key[0] == path]:
+            self.remove(key)
+
+    def clear(self):
+        self.entries.clear()
+        self.sizes.clear()
+        self.total_size = 0
+
+DECODE_CACHE = DecodeCache()
+
+def getCacheSize(value):
+    #Counts the array bytes held by a cached value or the attributes of a cached object
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(getCacheSize(item) for item in value)
+    if hasattr(value, "__dict__"):
+        return sum(getCacheSize(item) for item in vars(value).values())
+    return 0
+
+def getCached(path, offset, kind, loader):
+    #Returns loader() for the given file region, reusing the cached result while the file is unchanged
+    stat = os.stat(path)
+    key = (os.path.abspath(path), offset, kind, stat.st_mtime_ns, stat.st_size)
+    value = DECODE_CACHE.get(key)
+    if value is None:
+        value = loader()
+        DECODE_CACHE.put(key, value)
+    return value
+
+def invalidateCache(path):
+    #Drops every cached decode of a file, called by anything that writes to it
+    DECODE_CACHE.invalidate(path)
+
+def setCacheBudget(budget):
+    DECODE_CACHE.budget = budget
+    while DECODE_CACHE.total_size > budget:
+        DECODE_CACHE.remove(next(iter(DECODE_CACHE.entries)))
 
 def getColorCount(mode):
     
@@ -192,46 +296,58 @@ def readCLUT(file, offset, n_entries, mode):
     return buffer
 
 
+def flipArray(array, flip_mode):
+    #Flips are returned as views of the (height, width, ...) array
+    if flip_mode == HORIZONTAL:
+        return array[:, ::-1]
+    elif flip_mode == VERTICAL:
+        return array[::-1]
+    elif flip_mode == HORIZONTAL_AND_VERTICAL:
+        return array[::-1, ::-1]
+    return array
+
 def convertDirectColor(pxl, width, height, color_mode, flip_mode = NO_FLIP):
     
-    im = Image.new("RGBA", (width,height), (0, 0, 0, 0))
+    val = np.asarray(pxl, dtype=np.uint32).reshape((height, width))
+    rgba = np.zeros((height, width, 4), dtype=np.uint8)
     
     if color_mode == SIXTEEN_BIT_PS1_DIRECT:
-        for y in range(height):
-            for x in range(width):
-                val = pxl[width*y + x]
-                red = val & 0b11111
-                green = (val & 0b1111100000) >> 5
-                blue = (val & 0b111110000000000) >> 10
-                semitransparency_flag = (val & 0x8000)
-                
-                if red == green == blue == semitransparency_flag == 0:
-                    pixel =  (red<<3, green<<3, blue<<3, 0)
-                else:
-                    pixel =  (red<<3, green<<3, blue<<3, 255)
-
-                im.putpixel((x,y), pixel)
-    elif color_mode == THIRTY_TWO_BIT_PS2_DIRECT or color_mode == THIRTY_TWO_BIT_DIRECT:
-        for y in range(height):
-            for x in range(width):
-                val = pxl[width*y + x]
-                red    = val & 0xFF
-                green = (val & 0xFF00) >> 8
-                blue =  (val & 0xFF0000) >> 16
-                alpha = (val & 0xFF000000) >> 24
-                
-                if color_mode == THIRTY_TWO_BIT_DIRECT:
-                    pixel = (red, green, blue, alpha)
-                elif color_mode == TWENTY_FOUR_BIT_DIRECT:
-                    pixel = (red, green, blue, 255)
-                else:
-                    pixel = (red, green, blue, min(alpha*2, 255))
-                
-                im.putpixel((x,y), pixel)
-    
+        rgba[:, :, 0] = (val & 0b11111) << 3
+        rgba[:, :, 1] = ((val & 0b1111100000) >> 5) << 3
+        rgba[:, :, 2] = ((val & 0b111110000000000) >> 10) << 3
+        #Only black with the semitransparency flag off is transparent
+        rgba[:, :, 3] = np.where((val & 0xFFFF) == 0, 0, 255)
+    elif color_mode == THIRTY_TWO_BIT_PS2_DIRECT or color_mode == THIRTY_TWO_BIT_DIRECT or color_mode == TWENTY_FOUR_BIT_DIRECT:
+        rgba[:, :, 0] = val & 0xFF
+        rgba[:, :, 1] = (val & 0xFF00) >> 8
+        rgba[:, :, 2] = (val & 0xFF0000) >> 16
+        alpha = (val & 0xFF000000) >> 24
+        
+        if color_mode == THIRTY_TWO_BIT_DIRECT:
+            rgba[:, :, 3] = alpha
+        elif color_mode == TWENTY_FOUR_BIT_DIRECT:
+            rgba[:, :, 3] = 255
+        else:
+            rgba[:, :, 3] = np.minimum(alpha*2, 255)
     
+    im = Image.fromarray(np.ascontiguousarray(flipArray(rgba, flip_mode)), "RGBA")
     return im
 
+def encodeDirectColor(rgba, color_mode):
+    #Inverse of convertDirectColor, returns a (height, width) array of direct color values
+    rgba = rgba.astype(np.uint32)
+    red, green, blue, alpha = rgba[:, :, 0], rgba[:, :, 1], rgba[:, :, 2], rgba[:, :, 3]
+    
+    if color_mode == SIXTEEN_BIT_PS1_DIRECT:
+        red, green, blue = red >> 3, green >> 3, blue >> 3
+        #Only black with zero alpha keeps the semitransparency flag off
+        stp = ((alpha | red | green | blue) != 0).astype(np.uint32)
+        return (red | (green << 5) | (blue << 10) | (stp << 15)).astype(np.uint16)
+    elif color_mode == THIRTY_TWO_BIT_PS2_DIRECT:
+        return red | (green << 8) | (blue << 16) | (((alpha + 1)//2) << 24)
+    elif color_mode == TWENTY_FOUR_BIT_DIRECT:
+        return red | (green << 8) | (blue << 16)
+
 def getBMP(path, offset):
     file = open(path, 'rb')
     file.seek(0xA)
@@ -273,7 +389,7 @@ def getBMP(path, offset):
 
 def getTIM(path, offset, STP_mode=TIMresource.STP_FIFTY_FIFTY):
     file = open(path, 'rb')
-    file.read(offset)
+    file.seek(offset)
     timObj = TIMresource.TIM(file)
     
     if timObj.CF==1:
@@ -349,44 +465,28 @@ def convertImage(image_definition, clut_definition, output_path, show_output=Fal
     height = image_definition["HEIGHT"]
     width = image_definition["WIDTH"]
     
+    if "FLIP" in image_definition:
+        flip_mode = image_definition["FLIP"]
+    else:
+        flip_mode = NO_FLIP
+
     if clut_definition["CLUT_MODE"] != NO_CLUT:
         #indexed color
         clut_file = open(clut_definition["CLUT_FILE"], "rb")
         n_clut_entries = getColorCount(image_definition["PXL_MODE"])
         clut = readCLUT(clut_file,clut_definition["CLUT_OFFSET"], n_clut_entries, clut_definition["CLUT_MODE"])
+        clut_file.close()
         
-        im = Image.new("RGBA", (image_definition["WIDTH"],image_definition["HEIGHT"]), (0, 0, 0, 0))
-
-        for y in range(height):
-            for x in range(width):
-                pixel =  clut[pxl[y*image_definition["WIDTH"] + x]]  
-                im.putpixel((x,y), pixel)
-        if "FLIP" in image_definition:
-            if image_definition["FLIP"] == HORIZONTAL:
-                im = ImageOps.mirror(im)
-            elif image_definition["FLIP"] == VERTICAL:
-                im = ImageOps.flip(im)
-            elif image_definition["FLIP"] == HORIZONTAL_AND_VERTICAL:
-                im = ImageOps.mirror(im)
-                im = ImageOps.flip(im)
-        if show_output:
-            im.show()
-        im.save(output_path)
+        palette = np.array(clut, dtype=np.uint8).reshape((-1, 4))
+        rgba = palette[pxl]
+        im = Image.fromarray(np.ascontiguousarray(flipArray(rgba, flip_mode)), "RGBA")
     else:
         #direct color
-        im = convertDirectColor(pxl, image_definition["WIDTH"],image_definition["HEIGHT"], image_definition["PXL_MODE"], flip_mode = NO_FLIP)
+        im = convertDirectColor(pxl, width, height, image_definition["PXL_MODE"], flip_mode = flip_mode)
         
-        if "FLIP" in image_definition:
-            if image_definition["FLIP"] == HORIZONTAL:
-                im = ImageOps.mirror(im)
-            elif image_definition["FLIP"] == VERTICAL:
-                im = ImageOps.flip(im)
-            elif image_definition["FLIP"] == HORIZONTAL_AND_VERTICAL:
-                im = ImageOps.mirror(im)
-                im = ImageOps.flip(im)
-        if show_output:
-            im.show()
-        im.save(output_path)
+    if show_output:
+        im.show()
+    im.save(output_path)
     return im
 
 def gridConvert(images, cluts, output_path, dimensions, show_output=False, STP_MODE = TIMresource.STP_OFF):
@@ -447,6 +547,26 @@ def getAlpha(palette):
     #print("ERROR: ALPHA NOT FOUND!!!!")
     return 0
 
+#Maps every pixel of an image to its closest palette index, same result as calling closest per pixel
+def quantizeImage(image, palette):
+    pixels = np.asarray(image.convert("RGBA"))
+    palette = np.asarray(palette, dtype=np.int64).reshape(-1, 4)
+
+    #Work on unique colours only and scatter the result back
+    colors, inverse = np.unique(pixels.reshape(-1, 4), axis=0, return_inverse=True)
+    colors = colors.astype(np.int64)
+    color_indices = np.empty(len(colors), dtype=np.int64)
+
+    for start in range(0, len(colors), QUANTIZE_CHUNK_SIZE):
+        chunk = colors[start:start + QUANTIZE_CHUNK_SIZE]
+        distances = np.sum((chunk[:, None, :] - palette[None, :, :])**2, axis=2)
+        color_indices[start:start + QUANTIZE_CHUNK_SIZE] = np.argmin(distances, axis=1)
+
+    color_indices[colors[:, 3] == 0] = getAlpha(palette)
+
+    index_type = np.uint8 if len(palette) <= 0x100 else np.uint16
+    return color_indices.astype(index_type)[inverse.reshape(-1)].reshape(pixels.shape[:2])
+
 def gridInject(images, cluts, png_path, dimensions, STP_mode=TIMresource.STP_OFF):
 
     canvas = Image.open(png_path)
@@ -493,21 +613,17 @@ def editPalette(clutdef, palette):
             clutFile.seek(offset + 4*colorID)
             clutFile.write(color.to_bytes(4, "little"))
     clutFile.close()
+    invalidateCache(clutdef["CLUT_FILE"])
     return
     
 def getSkipMask(image1, image2):
-    image1 = image1.convert("RGBA")
-    image2 = image2.convert("RGBA")
-    canvas = Image.new("RGBA", (image1.width, image1.height), (0,0,0,0))
-
-    for y in range(canvas.height):
-        for x in range(canvas.width):
-            color1 = image1.getpixel((x,y))
-            color2 = image2.getpixel((x,y))
-            if color1 == color2 or (color1[3] == 0 and color2[3] == 0):
-                canvas.putpixel((x, y), (255,0,0,255))
-    
-    return canvas
+    #Returns a (height, width) bool array, True where both images match or are both fully transparent
+    pixels1 = np.asarray(image1.convert("RGBA"))
+    pixels2 = np.asarray(image2.convert("RGBA"))
+
+    same_color = np.all(pixels1 == pixels2, axis=2)
+    both_transparent = (pixels1[:, :, 3] == 0) & (pixels2[:, :, 3] == 0)
+    return same_color | both_transparent
 
 def injectImage(imagedef, clutdef, png_path, STP_mode=TIMresource.STP_OFF, quantize = False, skipmask = False):
     print("Injecting PXL:", imagedef, "\nCLUT:", clutdef, "\nPNG:", png_path,"\n")
@@ -540,12 +656,9 @@ def injectImage(imagedef, clutdef, png_path, STP_mode=TIMresource.STP_OFF, quant
 
 
     pxl_parent_file = open(pxl_parent_path, "r+b")
-    pxl_parent_file.seek(imagedef["PXL_OFFSET"])
     
     edited_im = Image.open(png_path).convert("RGBA")
     
-    color_dict = {}
-    
     if "FLIP" in imagedef:
         if imagedef["FLIP"] == HORIZONTAL:
             edited_im = ImageOps.mirror(edited_im)
@@ -555,165 +668,44 @@ def injectImage(imagedef, clutdef, png_path, STP_mode=TIMresource.STP_OFF, quant
             edited_im = ImageOps.mirror(edited_im)
             edited_im = ImageOps.flip(edited_im)
     
+    #Quantize the whole image at once for indexed modes
+    if clutdef["CLUT_MODE"] != NO_CLUT:
+        indices = quantizeImage(edited_im, clut)
+
     pxl_mode = imagedef["PXL_MODE"]
+    pxl_offset = imagedef["PXL_OFFSET"]
+    height = imagedef["HEIGHT"]
+    inset = -1
+    if "PXL_INSET" in imagedef:
+        inset = imagedef["PXL_INSET"]
+
+    pixels = None
     if pxl_mode == ONE_BIT:
         #TODO
         pass
-    elif pxl_mode == TWO_BIT:
-        for y in range(imagedef["HEIGHT"]):
-            for x in range(imagedef["WIDTH"]//4):
-                oldval = int.from_bytes(pxl_parent_file.read(1), "little")
-                pxl_parent_file.seek(pxl_parent_file.tell() - 1)
-
-                x1 = x*4
-                y1 = y
-                
-                if skipmask == False or skipmask.getpixel((x1,y1))[3] == 0:
-                    edit_color1 = edited_im.getpixel((x1, y1))
-                    val1 = closest(edit_color1, clut, color_dict)
-                else:
-                    val1 = oldval & 0x03
-                
-                
-                x2 = x*4 + 1
-                y2 = y
-
-                if skipmask == False or skipmask.getpixel((x2,y2))[3] == 0:
-                    edit_color2 = edited_im.getpixel((x2, y2))
-                    val2 = closest(edit_color2, clut, color_dict)
-                else:
-                    val2 = (oldval & 0x0C) >> 2
-                
-                
-                x3 = x*4 + 2
-                y3 = y
-
-                if skipmask == False or skipmask.getpixel((x3,y3))[3] == 0:
-                    edit_color3 = edited_im.getpixel((x3, y3))
-                    val3 = closest(edit_color3, clut, color_dict)
-                else:
-                    val3 = (oldval & 0x30) >> 4
-                
-                x4 = x*4 + 3
-                y4 = y
-
-                if skipmask == False or skipmask.getpixel((x4,y4))[3] == 0:
-                    edit_color4 = edited_im.getpixel((x4, y4))
-                    val4 = closest(edit_color4, clut, color_dict)
-                else:
-                    val4 = (oldval & 0xC0) >> 6
-                
-                
-                new_byte = val1 | (val2 << 2) | (val3 << 4) | (val4 << 6)
-                pxl_parent_file.write(new_byte.to_bytes(1, "little"))
-            
-            if "PXL_INSET" in imagedef:
-                pxl_parent_file.read(imagedef["PXL_INSET"])
-    elif pxl_mode == FOUR_BIT:
-        for y in range(imagedef["HEIGHT"]):
-            for x in range(imagedef["WIDTH"]//2):
-                x1 = x*2
-                y1 = y
-                oldval = int.from_bytes(pxl_parent_file.read(1), "little")
-                pxl_parent_file.seek(pxl_parent_file.tell() - 1)
-
-                if skipmask == False or skipmask.getpixel((x1,y1))[3] == 0:
-                    edit_color1 = edited_im.getpixel((x1, y1))
-                    val1 = closest(edit_color1, clut, color_dict)
-                else:
-                    val1 = oldval & 0xF
-                
-                
-                x2 = x*2 + 1
-                y2 = y
-
-                if skipmask == False or skipmask.getpixel((x2,y2))[3] == 0:
-                    edit_color2 = edited_im.getpixel((x2, y2))
-                    val2 = closest(edit_color2, clut, color_dict)
-                else:
-                    val2 = (oldval & 0xF0) >> 4
-
-
-                
-                new_byte = val1 | (val2 << 4)
-                pxl_parent_file.write(new_byte.to_bytes(1, "little"))
-            
-            if "PXL_INSET" in imagedef:
-                pxl_parent_file.read(imagedef["PXL_INSET"])
-    elif pxl_mode == EIGHT_BIT:
-        for y in range(imagedef["HEIGHT"]):
-            for x in range(imagedef["WIDTH"]):
-
-                if skipmask != False and skipmask.getpixel((x,y))[3] > 0:
-                    pxl_parent_file.read(1)
-                    continue
-
-                edit_color = edited_im.getpixel((x, y))
-                val = closest(edit_color, clut, color_dict)
-                pxl_parent_file.write(val.to_bytes(1, "little"))
-                
-            if "PXL_INSET" in imagedef:
-                pxl_parent_file.read(imagedef["PXL_INSET"])
-    elif pxl_mode == SIXTEEN_BIT_PS1_DIRECT:
-        for y in range(imagedef["HEIGHT"]):
-            for x in range(imagedef["WIDTH"]):
-
-                if skipmask != False and skipmask.getpixel((x,y))[3] > 0:
-                    pxl_parent_file.read(2)
-                    continue
-
-                color = edited_im.getpixel((x, y))
-                red = color[0]>>3
-                green = color[1] >> 3
-                blue = color[2] >> 3
-                alpha = color[3]
-                if alpha == red == green == blue == 0:
-                    stp = 0
-                else:
-                    stp = 1
-                    
-                val = red | (green <<5) | (blue << 10) | (stp << 15) #R,G,B
-                pxl_parent_file.write(val.to_bytes(2, "little"))
-                
-            if "PXL_INSET" in imagedef:
-                pxl_parent_file.read(imagedef["PXL_INSET"])
-    elif pxl_mode == THIRTY_TWO_BIT_PS2_DIRECT:
-        for y in range(imagedef["HEIGHT"]):
-            for x in range(imagedef["WIDTH"]):
-                if skipmask != False and skipmask.getpixel((x,y))[3] > 0:
-                    pxl_parent_file.read(4)
-                    continue
-
-                color = edited_im.getpixel((x, y))
-                #red = color[0]
-                #green = color[1]
-                #blue = color[2]
-                alpha = (color[3] + 1) //2
-                
-                pxl_parent_file.write(color[0].to_bytes(1, "little"))
-                pxl_parent_file.write(color[1].to_bytes(1, "little"))
-                pxl_parent_file.write(color[2].to_bytes(1, "little"))
-                pxl_parent_file.write(alpha.to_bytes(1, "little"))
-                
-            if "PXL_INSET" in imagedef:
-                pxl_parent_file.read(imagedef["PXL_INSET"])
-    elif pxl_mode == TWENTY_FOUR_BIT_DIRECT:
-        for y in range(imagedef["HEIGHT"]):
-            for x in range(imagedef["WIDTH"]):
-                if skipmask != False and skipmask.getpixel((x,y))[3] > 0:
-                    pxl_parent_file.read(3)
-                    continue
-
-                color = edited_im.getpixel((x, y))
-                #red = color[0]
-                #green = color[1]
-                #blue = color[2]
-                
-                pxl_parent_file.write(color[0].to_bytes(1, "little"))
-                pxl_parent_file.write(color[1].to_bytes(1, "little"))
-                pxl_parent_file.write(color[2].to_bytes(1, "little"))
+    elif pxl_mode == TWO_BIT or pxl_mode == FOUR_BIT or pxl_mode == EIGHT_BIT:
+        #Trailing pixels that do not fill a whole byte are left untouched
+        pixels_per_byte = 8//PXL_MODE_BITS[pxl_mode]
+        width = imagedef["WIDTH"]//pixels_per_byte*pixels_per_byte
+        pixels = indices[:height, :width]
+    elif pxl_mode == SIXTEEN_BIT_PS1_DIRECT or pxl_mode == THIRTY_TWO_BIT_PS2_DIRECT or pxl_mode == TWENTY_FOUR_BIT_DIRECT:
+        width = imagedef["WIDTH"]
+        pixels = encodeDirectColor(np.asarray(edited_im)[:height, :width], pxl_mode)
+
+    if pixels is not None:
+        #Keep the pixels already in the file wherever the skip mask is set
+        if skipmask is not False and skipmask is not None:
+            if isinstance(skipmask, Image.Image):
+                #Older RGBA canvases mark skipped pixels with alpha
+                skipmask = np.asarray(skipmask.convert("RGBA"))[:, :, 3] > 0
+            keep = np.asarray(skipmask, dtype=bool)[:height, :width]
+            old_pixels = readPXL(pxl_parent_file, pxl_offset, width, height, pxl_mode, inset)
+            pixels = np.where(keep, old_pixels, pixels)
+
+        writePXL(pxl_parent_file, pxl_offset, packPXL(pixels, pxl_mode), inset)
 
     pxl_parent_file.close()
+    invalidateCache(pxl_parent_path)
     if "NO_FILE" in imagedef:
         pxl_file = open(tempPath, "rb")
 
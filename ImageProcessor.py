@@ -2,13 +2,19 @@
 #from logging import exception
 from PIL import Image,ImageDraw, ImageFont
 import filecmp
+import hashlib
+import json
 import re
 import os
+import mmap
+import struct
+import time
 import numpy as np
 import subprocess
 import ImageHill
 import sys
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 
 print("Commencing")
 FOUR_BIT_CLUT    = 0
@@ -27,6 +33,18 @@ EIGHT_BIT_MASK_2 = 0b1111111100000000
 PXL_HEADER_SIZE = 0x14
 PXL_ID = 0x11
 CLT_ID = 0x12
+ANM_ID = 0x40000321
+
+#VRAM layout
+BANK_WIDTH = 64
+SHELF_WIDTH = 16
+SHELF_HEIGHT = 256
+TEXTURE_PAGE_COUNT = 32
+CLX_COUNT = 64
+CLY_COUNT = 512
+
+#Semi transparency foreground/background rates for each ABR
+ABR_RATES = {0 : (0.5, 0.5), 1 : (1.0, 1.0), 2 : (-1.0, 1.0), 3 : (0.25, 1.0)}
 
 OUTPUT_FOLDER = "OUTPUT"
 ORIGINAL_FOLDER = "ORIGINAL"
@@ -50,6 +68,8 @@ NEWLINE_DISTANCE = 16 #Y distance moved after a newline
 #Per-game variables
 SOURCE_FOLDER = "PS1_Base_Project/cd/working/"
 BASE_FOLDER = "PS1_Base_Project/cd/orig/"
+MANIFEST_PATH = "build_manifest.json" #Content hashes of the last injection jobs
+LETTER_METRICS_PATH = "letter_metrics.json" #Disk cache of getLetterCoords results
 GAME_NAME = "Harmful Park" #Checked for game specific sprite params
 
 HAR_ORIGINAL_FOLDER = 'HAR Original'
@@ -125,19 +145,40 @@ IMAGES = [["SZINGAME/STAT_PXL.PAC", "ANM/P00.CLS"],
             ]
 
 #ANM classes
+#Structured layouts ANM records are held in, int32 so unpacked -1 sizes and out of range edits survive until repack
+SEQUENCE_DTYPE = np.dtype([(name, '<i4') for name in ('spriteGrpNumber', 'time', 'attr', 'hotSpotX', 'hotSpotY')])
+SPRITE_DTYPE = np.dtype([(name, '<i4') for name in ('u', 'v', 'ofsX', 'ofsY', 'CLX', 'CLY', 'ABE', 'TexturePageNumber', 'ABR', 'TPFSprite', 'RSZ', 'ROT', 'THW', 'Width', 'Height', 'Rotation', 'Flag2Reserve', 'CSN', 'BNO', 'XScaling', 'YScaling')])
+CLUTGRP_DTYPE = np.dtype([(name, '<i4') for name in ('bnum', 'DX', 'DY', 'W', 'H')])
+
+#Returns records (a record array, or objects/tuples with the dtype's fields) as a record array
+def getRecordArray(records, dtype):
+    if isinstance(records, np.ndarray):
+        return records.astype(dtype, copy=False).view(np.recarray)
+
+    rows = []
+    for record in records:
+        if isinstance(record, tuple):
+            rows.append(record)
+        else:
+            rows.append(tuple(getattr(record, name) for name in dtype.names))
+    return np.array(rows, dtype=dtype).view(np.recarray)
+
 class ANM:
+    '''A parsed ANM, sequences are a SEQUENCE_DTYPE record array'''
     def __init__(self, ID, version, NCLUTS, TPF, sequences, spriteGroups, CLUTGrps, fileName, offset):
         self.fileName = fileName
         self.ID = ID
         self.version = version
         self.NCLUTS = NCLUTS
         self.TPF = TPF
-        self.sequences = sequences
+        self.sequences = getRecordArray(sequences, SEQUENCE_DTYPE)
         self.spriteGroups = spriteGroups
         self.CLUTGrps = CLUTGrps
         self.offset = offset
 
 class SEQUENCE:
+    '''A single sequence, ANMs store these as rows of SEQUENCE_DTYPE'''
+    __slots__ = SEQUENCE_DTYPE.names
     def __init__(self, spriteGrpNumber, time, attr, hotSpotX, hotSpotY):
         self.spriteGrpNumber = spriteGrpNumber
         self.time = time
@@ -146,11 +187,46 @@ class SEQUENCE:
         self.hotSpotY = hotSpotY
 
 class SPRGRP:
-    def __init__(self, NSprite, sprites):
-        self.NSprite = NSprite
-        self.sprites = sprites
+    '''A sprite group, sprites are a SPRITE_DTYPE record array so edits can be done per field on the whole group'''
+    def __init__(self, sprites):
+        self.sprites = getRecordArray(sprites, SPRITE_DTYPE)
+
+    @property
+    def NSprite(self):
+        return len(self.sprites)
+
+    #Returns a sprite as a SPRITE object holding plain ints
+    def getSprite(self, spriteNumber):
+        return SPRITE(*self.sprites[spriteNumber].item())
+
+    #Appends SPRITE objects or SPRITE_DTYPE records to the group
+    def appendSprites(self, sprites):
+        self.sprites = np.concatenate((self.sprites, getRecordArray(sprites, SPRITE_DTYPE))).view(np.recarray)
+
+    #Keeps only the sprites at the given indices, in that order
+    def keepSprites(self, spriteNumbers):
+        self.sprites = self.sprites[np.asarray(spriteNumbers, dtype=np.intp)]
+
+    #Removes the sprites at the given indices, indices past the end are ignored
+    def dropSprites(self, spriteNumbers):
+        keepMask = np.ones(len(self.sprites), dtype=bool)
+        dropNumbers = np.asarray(spriteNumbers, dtype=np.intp)
+        keepMask[dropNumbers[(dropNumbers >= 0) & (dropNumbers < len(self.sprites))]] = False
+        self.sprites = self.sprites[keepMask]
+
+    #Shifts the offsets of every sprite in the group
+    def shiftOffsets(self, deltaX, deltaY):
+        self.sprites.ofsX += deltaX
+        self.sprites.ofsY += deltaY
+
+    #Points every sprite in the group at another CLUT
+    def setCLUT(self, CLX, CLY):
+        self.sprites.CLX = CLX
+        self.sprites.CLY = CLY
 
 class SPRITE:
+    '''A single sprite, sprite groups store these as rows of SPRITE_DTYPE'''
+    __slots__ = SPRITE_DTYPE.names
     def __init__(self, u,v, ofsX, ofsY, CLX, CLY, ABE, TexturePageNumber, ABR, TPFSprite, RSZ, ROT, THW, Width, Height, Rotation, Flag2Reserve, CSN, BNO, XScaling, YScaling):
         self.u = u
         self.v = v
@@ -176,6 +252,8 @@ class SPRITE:
 
 
 class CLUTGRP:
+    '''A CLUT group, the header fields follow CLUTGRP_DTYPE and CLUTS holds the raw 16 bit entries'''
+    __slots__ = CLUTGRP_DTYPE.names + ('CLUTS',)
     def __init__(self, bnum, DX, DY, W, H, CLUTS):
         self.bnum = bnum
         self.DX = DX
@@ -230,6 +308,7 @@ class TIM:
                 self.CLUTW = readShort(args[0])
                 self.CLUTH = readShort(args[0])
                 self.CLUT = readCLTEntries(args[0], (self.CLUTbnum - 0xC)//2)
+                self.CLUTPalette = decodeCLTEntries(self.CLUT)
 
             self.bnum = readInt(args[0])
             self.DX = readShort(args[0])
@@ -266,7 +345,8 @@ class TIM:
             self.CLUTDY = args[12]
             self.CLUTW = args[13]
             self.CLUTH = args[14]
-            self.CLUT = args[15]
+            self.CLUT = np.asarray(args[15], dtype=np.uint16)
+            self.CLUTPalette = decodeCLTEntries(self.CLUT)
         
         else:
             assert False, "TIM constructor arguments must be 1 file or 10 parameters(no clut) or 16 parameters(clut)!"
@@ -370,6 +450,7 @@ class CLT:
             self.H = readShort(args[0])
 
             self.CLUTs = readCLTEntries(args[0], (self.bnum - 0xC)//2)
+            self.palette = decodeCLTEntries(self.CLUTs)
         
         elif len(args) == 9:
             self.ID = args[0]
@@ -381,10 +462,171 @@ class CLT:
             self.W = args[6]
             self.H = args[7]
 
-            self.CLUTs = args[8]
+            self.CLUTs = np.asarray(args[8], dtype=np.uint16)
+            self.palette = decodeCLTEntries(self.CLUTs)
         else:
             assert False, "CLT constructor arguments must be 1 file or 8 parameters!"
 
+#PAC Classes
+class PacArchive:
+    '''Memory maps a PAC file once and hands out its entries as memoryview slices'''
+    def __init__(self, path, writable = False):
+        self.path = path
+        self.writable = writable
+
+        if writable:
+            self.file = open(path, "r+b")
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE)
+        else:
+            self.file = open(path, "rb")
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.data)
+
+        numEntries = struct.unpack_from('<I', self.data, 0)[0]
+        self.offsets = list(struct.unpack_from('<' + str(numEntries) + 'I', self.data, 4))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    #Returns the start and end offsets of an entry, the last entry runs to the end of the file
+    def getEntryBounds(self, entryNumber):
+        start = self.offsets[entryNumber]
+        if entryNumber == len(self.offsets) - 1:
+            end = len(self.data)
+        else:
+            end = self.offsets[entryNumber + 1]
+        return start, end
+
+    #Returns an entry as a zero-copy memoryview
+    def getEntry(self, entryNumber):
+        start, end = self.getEntryBounds(entryNumber)
+        return self.view[start:end]
+
+    #Overwrites an entry in place, returns False if the size differs and the PAC must be rebuilt
+    def writeEntry(self, entryNumber, data):
+        assert self.writable, "PAC archive " + self.path + " was not opened for writing"
+        start, end = self.getEntryBounds(entryNumber)
+        if len(data) != end - start:
+            return False
+        self.view[start:end] = data
+        self.data.flush()
+        return True
+
+    def close(self):
+        self.view.release()
+        self.data.close()
+        self.file.close()
+
+#Build Manifest Classes
+class BuildManifest:
+    '''JSON record of the input and output hashes of every injection job, used to skip jobs with nothing to do'''
+    def __init__(self, path = MANIFEST_PATH):
+        self.path = path
+        self.jobs = {}
+        if os.path.exists(path):
+            with open(path, "r") as manifestFile:
+                self.jobs = json.load(manifestFile)
+
+    #Returns the sha256 of a file, or of a [path, offset, size] region of it, None if the file is missing
+    def hashFile(self, target):
+        if isinstance(target, str):
+            path, offset, size = target, 0, -1
+        else:
+            path, offset, size = target
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as targetFile:
+            targetFile.seek(offset)
+            return hashlib.sha256(targetFile.read(size)).hexdigest()
+
+    #Returns the record stored for a job with the given inputs, outputs and parameters as they are now
+    def getJobRecord(self, inputs, outputs, parameters = None):
+        record = {}
+        record["inputs"] = [[str(target), self.hashFile(target)] for target in inputs]
+        record["outputs"] = [[str(target), self.hashFile(target)] for target in outputs]
+        record["parameters"] = repr(parameters)
+        return record
+
+    #A job is up to date when its inputs, parameters and the outputs it last wrote are all unchanged
+    def isUpToDate(self, jobName, inputs, outputs, parameters = None):
+        if jobName not in self.jobs:
+            return False
+        return self.jobs[jobName] == self.getJobRecord(inputs, outputs, parameters)
+
+    def record(self, jobName, record, save = True):
+        self.jobs[jobName] = record
+        if save:
+            self.save()
+
+    def save(self):
+        tempPath = self.path + ".tmp"
+        with open(tempPath, "w") as manifestFile:
+            json.dump(self.jobs, manifestFile, indent = 1, sort_keys = True)
+        os.replace(tempPath, self.path)
+
+#VRAM Classes
+class VRAMIndex:
+    '''Maps texture page numbers to PXLs and CLUT coordinates to CLTs for one set of PXLs and CLTs'''
+    def __init__(self, PXLs, CLTs):
+        self.pages = {}
+        self.cluts = {}
+        self.overlaps = []
+
+        #First PXL covering the page origin wins, matching the old linear search
+        for TPN in range(TEXTURE_PAGE_COUNT):
+            pageDX, pageDY = getTexturePageOrigin(TPN)
+            matches = [pxl for pxl in PXLs if pageDX >= pxl.DX and pageDX < (pxl.DX + pxl.W) and pageDY >= pxl.DY and pageDY < (pxl.DY + pxl.H)]
+            if len(matches) > 0:
+                self.pages[TPN] = matches[0]
+            if len(matches) > 1:
+                self.overlaps.append(["TPN", TPN, matches])
+
+        #CLX counts 16 entry columns, CLY counts CLUT rows
+        clutMatches = {}
+        for clt in CLTs:
+            for CLX in range(CLX_COUNT):
+                trueCLUTX = 0x10 * CLX - clt.DX
+                if trueCLUTX < 0 or trueCLUTX >= clt.W:
+                    continue
+                for CLY in range(max(clt.DY, 0), min(clt.DY + clt.H, CLY_COUNT)):
+                    clutMatches.setdefault((CLX, CLY), []).append(clt)
+
+        for coordinate, matches in clutMatches.items():
+            self.cluts[coordinate] = matches[0]
+            if len(matches) > 1:
+                self.overlaps.append(["CLUT", coordinate, matches])
+
+    #Returns the PXL holding a texture page, or None
+    def findPXL(self, TPN):
+        return self.pages.get(TPN)
+
+    #Returns the CLT holding the CLUT at CLX/CLY, or None
+    def findCLT(self, CLX, CLY):
+        return self.cluts.get((CLX, CLY))
+
+    #Returns a line per texture page or CLUT coordinate claimed by more than one asset
+    def getOverlapReport(self):
+        lines = []
+        for kind, key, matches in self.overlaps:
+            matchStrings = []
+            for match in matches:
+                matchStrings.append("DX/DY " + str(match.DX) + "/" + str(match.DY) + " W/H " + str(match.W) + "/" + str(match.H))
+            lines.append("[WARNING] " + kind + " " + str(key) + " is covered by " + str(len(matches)) + " assets, using the first: " + ", ".join(matchStrings))
+        return lines
+
+#Returns the VRAM DX/DY of a texture page number
+def getTexturePageOrigin(TPN):
+    shelfNumber = TPN // SHELF_WIDTH
+    pageDX = (TPN % SHELF_WIDTH) * BANK_WIDTH
+    pageDY = shelfNumber * SHELF_HEIGHT
+    return pageDX, pageDY
+
 #Converts a TIM to a PXL + CLT
 def extractTIM(TIMObj):
     PXLObj = PXL(PXL_ID, TIMObj.version, TIMObj.PMD, TIMObj.bnum, TIMObj.DX, TIMObj.DY, TIMObj.W, TIMObj.H, TIMObj.PXLData)
@@ -421,31 +663,47 @@ def readByte(file):
     readByte = int.from_bytes(file.read(1), byteorder='little')
     return readByte
 
-#Returns a PXL file of given length as value array
+#Returns a PXL file of given length as a uint8 array of CLUT indices
 def readPXLEntries(file, PMODE, fileLength):
-    PXL_Entries = []
-    for x in range(fileLength // 2):
-        pixels = readShort(file)
-        if PMODE == FOUR_BIT_CLUT:
-            PXL_Entries +=  [pixels & FOUR_BIT_MASK_1]
-            PXL_Entries += [(pixels & FOUR_BIT_MASK_2) >> 4]
-            PXL_Entries += [(pixels & FOUR_BIT_MASK_3) >> 8]
-            PXL_Entries += [(pixels & FOUR_BIT_MASK_4) >> 12]
-
-        elif PMODE == EIGHT_BIT_CLUT:
-            PXL_Entries += [pixels & EIGHT_BIT_MASK_1]
-            PXL_Entries += [(pixels & EIGHT_BIT_MASK_2) >> 8]
+    byteCount = (fileLength // 2) * 2
+    PXLBytes = file.read(byteCount)
 
-        else:
-            assert False, "UNRECOGNIZED PMODE"
+    #Short reads decode as zero pixels, matching the old per-word reader
+    if len(PXLBytes) < byteCount:
+        PXLBytes = bytes(PXLBytes) + bytes(byteCount - len(PXLBytes))
+
+    return unpackPXLBytes(PXLBytes, PMODE)
+
+#Returns a PXL object parsed from a bytes-like buffer such as a PacArchive entry
+def readPXLBuffer(buffer):
+    ID, version, flag, bnum, DX, DY, W, H = struct.unpack_from('<BBxxIIHHHH', buffer, 0)
+    PMD = flag & 0b1
+    PXLData = unpackPXLBytes(buffer[PXL_HEADER_SIZE:PXL_HEADER_SIZE + ((bnum - 0xC)//2)*2], PMD)
+    return PXL(ID, version, PMD, bnum, DX, DY, W, H, PXLData)
+
+#Unpacks raw 4/8 bit PXL data (bytes, bytearray or memoryview) into one CLUT index per pixel
+def unpackPXLBytes(PXLBytes, PMODE):
+    packed = np.frombuffer(PXLBytes, dtype=np.uint8)
+
+    if PMODE == FOUR_BIT_CLUT:
+        #Low nibble is the leftmost pixel of each byte
+        PXL_Entries = np.empty(packed.size * 2, dtype=np.uint8)
+        PXL_Entries[0::2] = packed & 0x0F
+        PXL_Entries[1::2] = packed >> 4
+
+    elif PMODE == EIGHT_BIT_CLUT:
+        PXL_Entries = packed.copy()
+
+    else:
+        assert False, "UNRECOGNIZED PMODE"
 
     return PXL_Entries
 
-#Returns a specific CLUT from a file as RGBA array
+#Returns a specific CLUT from a file as a uint16 array of raw 5551 entries
 def getCLUT(clutFile, CLUTOffset, CLUTNumber, PMODE):
 
     CLTFile = clutFile
-    CLTFile.read(CLUTOffset)
+    CLTFile.seek(CLUTOffset, os.SEEK_CUR)
 
     CLT_ID    = readInt(CLTFile)
     CLT_PMODE = readInt(CLTFile)
@@ -462,64 +720,92 @@ def getCLUT(clutFile, CLUTOffset, CLUTNumber, PMODE):
     
     CLUTStart = CLUT_SIZE * CLUTNumber
 
-    CLTFile.read(CLUTStart)
+    CLTFile.seek(CLUTStart, os.SEEK_CUR)
 
     CLUT = readCLTEntries(CLTFile, CLUT_SIZE//2)
     
     return CLUT
 
-#Returns X number of CLT entries as an RGBA array
+#Returns X number of CLT entries as a uint16 array of raw 5551 entries
 def readCLTEntries(file, numEntries):
-    CLT_Entries = []
-    for x in range(numEntries):
-        entry = readShort(file)
+    entryBytes = file.read(numEntries * 2)
+
+    #Short reads decode as zero entries, matching the old per-entry reader
+    if len(entryBytes) < numEntries * 2:
+        entryBytes = bytes(entryBytes) + bytes(numEntries * 2 - len(entryBytes))
 
-        red   =  entry & 0b0000000000011111
-        green = (entry & 0b0000001111100000) >> 5
-        blue  = (entry & 0b0111110000000000) >> 10
-        alpha = (entry & 0b1000000000000000) >> 15
+    return np.frombuffer(entryBytes, dtype='<u2').astype(np.uint16)
 
-        CLT_Entries += [[red, green, blue, alpha]]
+#Converts raw 5551 CLT entries into an (N,4) uint8 RGBA palette
+def decodeCLTEntries(entries):
+    entries = np.asarray(entries, dtype=np.uint16)
 
+    palette = np.empty((entries.size, 4), dtype=np.uint8)
+    palette[:, 0] = (entries & 0b0000000000011111) << 3
+    palette[:, 1] = ((entries & 0b0000001111100000) >> 5) << 3
+    palette[:, 2] = ((entries & 0b0111110000000000) >> 10) << 3
+    #Only the all-zero entry (black, STP off) is transparent
+    palette[:, 3] = np.where(entries == 0, 0, 255)
 
-    return CLT_Entries
+    return palette
+
+#Packs 5 bit red/green/blue and an STP bit into a raw 5551 CLT entry
+def encodeCLTEntry(red, green, blue, STP):
+    return red | (green << 5) | (blue << 10) | (STP << 15)
+
+#Returns the index of the first CLT entry equal to value, raising ValueError like list.index
+def findCLTEntry(entries, value):
+    matches = np.flatnonzero(np.asarray(entries) == value)
+    if matches.size == 0:
+        raise ValueError(str(value) + " is not in CLT")
+    return int(matches[0])
 
 #Returns an ANM file as an ANM object
 def readANM(file, offset):
-    file.seek(offset)
-    ANM_ID      = readByte(file)
-    ANM_Version = readByte(file)
-    ANM_Flag    = readShort(file)
-    NSPRITEGp   = readShort(file)
-    NSEQUENCE   = readShort(file)
+    file.seek(0, os.SEEK_END)
+    if file.tell() == 0:
+        return parseANM(b'', offset, os.path.basename(file.name))
+
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as ANMData:
+        return parseANM(ANMData, offset, os.path.basename(file.name))
+
+#Precompiled ANM records, all little endian and unsigned
+ANM_HEADER_RECORD = struct.Struct('<BBHHH')
+ANM_SEQUENCE_RECORD = struct.Struct('<HBBHH')
+ANM_SPRITE_COUNT_RECORD = struct.Struct('<I')
+ANM_SPRITE_RECORD = struct.Struct('<BBBBHH')
+ANM_SPRITE_SIZE_RECORD = struct.Struct('<HH')
+ANM_SPRITE_TAIL_RECORD = struct.Struct('<HHHH')
+
+#Unpacks a record at the cursor and returns it with the advanced cursor, reads past the end decode as zeros like file reads do
+def unpackANMRecord(record, buffer, cursor):
+    if cursor + record.size > len(buffer):
+        return record.unpack(bytes(buffer[cursor:cursor + record.size]).ljust(record.size, b'\0')), cursor + record.size
+    return record.unpack_from(buffer, cursor), cursor + record.size
+
+#Returns the ANM at offset in a bytes like buffer (bytes, mmap or memoryview) as an ANM object
+def parseANM(buffer, offset, fileName):
+    (ANM_ID, ANM_Version, ANM_Flag, NSPRITEGp, NSEQUENCE), cursor = unpackANMRecord(ANM_HEADER_RECORD, buffer, offset)
     NCLUTS =   (ANM_Flag & 0b1111000000000000) >> 12
     TPF =     ANM_Flag & 0b11
 
     sequences = []
     
     for sequenceNumber in range(NSEQUENCE):
-        spriteGrpCount = readShort(file)
-        time = readByte(file)
-        attr = readByte(file) >> 4 #Dev specified value
-        hotSpotX = readShort(file)
-        hotSpotY = readShort(file)
-        sequences.append(SEQUENCE(spriteGrpCount, time, attr, hotSpotX, hotSpotY))
+        (spriteGrpCount, time, attr, hotSpotX, hotSpotY), cursor = unpackANMRecord(ANM_SEQUENCE_RECORD, buffer, cursor)
+        attr = attr >> 4 #Dev specified value
+        sequences.append((spriteGrpCount, time, attr, hotSpotX, hotSpotY))
 
     spriteGroups = []
     for spriteGroupNumber in range(NSPRITEGp):
-        NSprite = readInt(file)
+        (NSprite,), cursor = unpackANMRecord(ANM_SPRITE_COUNT_RECORD, buffer, cursor)
         sprites = []
         for spriteNumber in range(NSprite):
-            u = readByte(file) 
-            v = readByte(file)
-            ofsX = readByte(file)
-            ofsY = readByte(file)
-            CBA = readShort(file)
+            (u, v, ofsX, ofsY, CBA, FLAG1), cursor = unpackANMRecord(ANM_SPRITE_RECORD, buffer, cursor)
             CLX =  CBA &  0b111111
             CLY = (CBA &  0b111111111000000) >>6
             ABE = (CBA & 0b1000000000000000) >>15 #isSemiTransperencyProcessingOn
             
-            FLAG1 = readShort(file)
             TexturePageNumber   = FLAG1 & 0b11111
             ABR              = (FLAG1 & 0b1100000) >> 5 #Semi transperency rate
             TPFSprite      = (FLAG1 & 0b110000000) >> 7 #Pixel Depth 00->4bit 01->8bit 10->16bit
@@ -528,46 +814,40 @@ def readANM(file, offset):
             THW     = (FLAG1 & 0b1111000000000000) >> 12 #Square dimensions, else 0 and use H/W
             
             if THW == 0:
-                Width = readShort(file)
-                Height = readShort(file)
+                (Width, Height), cursor = unpackANMRecord(ANM_SPRITE_SIZE_RECORD, buffer, cursor)
             else:
                 Width = -1
                 Height = -1
-            Rotation = readShort(file)
-            spriteFlag2 = readShort(file)
+            (Rotation, spriteFlag2, XScaling, YScaling), cursor = unpackANMRecord(ANM_SPRITE_TAIL_RECORD, buffer, cursor)
             Flag2Reserve = (spriteFlag2 & 0b11111111)
             CSN = (spriteFlag2 &   0b11111100000000) >> 8 #Color set number (editor only)
             BNO = (spriteFlag2 & 0b1100000000000000) >> 14 #TIM Bank number
-            XScaling = readShort(file) 
-            YScaling = readShort(file)
-            sprites.append(SPRITE(u, v, ofsX, ofsY, CLX, CLY, ABE, TexturePageNumber, ABR, TPFSprite, RSZ, ROT, THW, Width, Height, Rotation, Flag2Reserve, CSN, BNO, XScaling, YScaling))
+            sprites.append((u, v, ofsX, ofsY, CLX, CLY, ABE, TexturePageNumber, ABR, TPFSprite, RSZ, ROT, THW, Width, Height, Rotation, Flag2Reserve, CSN, BNO, XScaling, YScaling))
 
-        spriteGroups.append(SPRGRP(NSprite, sprites))
+        spriteGroups.append(SPRGRP(sprites))
 
 
     CLUTGroups = []
-    """ if NCLUTS > 0:
-        for clutNumber in range(NCLUTS):
-            bnum = readInt(file)
-            DX = readShort(file)
-            DY = readShort(file)
-            clutWidth = readShort(file)
-            clutHeight = readShort(file)
-
-            CLUT = readCLTEntries(file, bnum - 0xC)
-            CLUTGroups.append(CLUTGRP(bnum, DX, DY, clutWidth, clutHeight, CLUT)) """
-    ANM_OBJ = ANM(ANM_ID, ANM_Version, NCLUTS, TPF, sequences,  spriteGroups, CLUTGroups, os.path.basename(file.name), offset)
+    ANM_OBJ = ANM(ANM_ID, ANM_Version, NCLUTS, TPF, sequences,  spriteGroups, CLUTGroups, fileName, offset)
 
 
     return ANM_OBJ
 
 #Saves the sequences of an ANM object as a set of images
-def animateANM(ANM, PXLs, CLUTs):
+def animateANM(ANM, PXLs, CLUTs, vramIndex = None):
     nSequences = len(ANM.sequences)
     if not os.path.exists(LOG_FOLDER):
         os.mkdir(LOG_FOLDER)
 
+    if vramIndex is None:
+        vramIndex = VRAMIndex(PXLs, CLUTs)
+
     logfile = open(os.path.join(LOG_FOLDER, ANM.fileName + '-' + str(ANM.offset) + '.log'), "w")
+    for overlapLine in vramIndex.getOverlapReport():
+        logfile.write(overlapLine + '\n')
+
+    #Rendered texture pages for this run, keyed by (PXL, CLT, CLUT number, TPF)
+    pageRenders = {}
     for sequenceNumber in range(nSequences):
 
         logfile.write("-----\nSequence #" + str(sequenceNumber) + ":\n-----\n")
@@ -590,7 +870,7 @@ def animateANM(ANM, PXLs, CLUTs):
         runningImage = Image.new('RGBA', (compositeWidth, compositeHeight), (0,0,0,0))
         for spriteNumber in range(numSprites):
             #Check all CLUTs and pick based on CLX/CLY within CLUT bounds
-            sprite = spriteGroup.sprites[spriteNumber]
+            sprite = spriteGroup.getSprite(spriteNumber)
             if sprite.THW ==  0:
                 spriteHeight = sprite.Height
                 spriteWidth  = sprite.Width
@@ -598,22 +878,15 @@ def animateANM(ANM, PXLs, CLUTs):
                 spriteHeight = sprite.THW << 3
                 spriteWidth  = sprite.THW << 3
 
-            clutfound = False
-            for searchCLUT in CLUTs:
-                clutXOffset = sprite.CLX - searchCLUT.DX
-                clutYOffset = sprite.CLY - searchCLUT.DY
-                trueCLUTX = 0x10 *sprite.CLX - searchCLUT.DX
-                trueCLUTY = sprite.CLY - searchCLUT.DY
-
-                if (trueCLUTX < searchCLUT.W) and (trueCLUTY < searchCLUT.H) and (trueCLUTX >= 0) and (trueCLUTY >= 0):
-                    #Correct CLUT found
-                    clutfound = True
-                    break
-            if not clutfound:
+            searchCLUT = vramIndex.findCLT(sprite.CLX, sprite.CLY)
+            if searchCLUT is None:
                 print("CLUT failsafe triggered on " + ANM.fileName + ' offset ' + str(ANM.offset) +  ' sequence ' + str(sequenceNumber) + " sprite " + str(spriteNumber))
                 continue
                 #assert False, "CLUT NOT FOUND"
             
+            clutXOffset = sprite.CLX - searchCLUT.DX
+            clutYOffset = sprite.CLY - searchCLUT.DY
+
             if sprite.TPFSprite == FOUR_BIT_CLUT:
                 clutNumber = clutYOffset + clutXOffset*0x10
                 #clutNumber = trueCLUTY + trueCLUTX
@@ -623,32 +896,9 @@ def animateANM(ANM, PXLs, CLUTs):
             else:
                 assert False, "INVALID CLUT"
 
-            #Check all PXls and pick based on sprite TPN matching PXL DX/DY
-            PXLFound = False
-            for pxl in PXLs:
-                BANK_WIDTH = 64
-                SHELF_WIDTH = 16
-                SHELF_HEIGHT = 256
-                pxlDX = pxl.DX
-                pxlDY = pxl.DY
-
-                shelfNumber = sprite.TexturePageNumber // SHELF_WIDTH
-
-                if shelfNumber == 0:
-                    spriteDY = 0
-                elif shelfNumber == 1:
-                    spriteDY = SHELF_HEIGHT
-
-                spriteDX = (sprite.TexturePageNumber % SHELF_WIDTH) * BANK_WIDTH
-
-                #DEBUGGING
-                spriteIsInRangeX = spriteDX >= pxl.DX and spriteDX < (pxl.DX + pxl.W)
-                spriteIsInRangeY = spriteDY >= pxl.DY and spriteDY < (pxl.DY + pxl.H)
-
-                if spriteIsInRangeX and spriteIsInRangeY:
-                    pxlMatch = pxl
-                    PXLFound = True
-                    break
+            #Pick the PXL whose DX/DY holds the sprite TPN
+            pxlMatch = vramIndex.findPXL(sprite.TexturePageNumber)
+            PXLFound = pxlMatch is not None
 
             if not PXLFound:
                 print("Could not find TPN match for " + ANM.fileName + ' sequence ' + str(sequenceNumber) + ' sprite number ' + str(spriteNumber))
@@ -682,9 +932,14 @@ def animateANM(ANM, PXLs, CLUTs):
                 logfile.write("Sprite rotation: " + str(sprite.Rotation) + '\n')
                 logfile.write("Sprite Flag2Reserve: " + str(sprite.Flag2Reserve) + '\n\n')
 
-            totalImage = generatePNG(pxlMatch.PXLData, searchCLUT.CLUTs, pxlMatch.W, pxlMatch.H, clutNumber, sprite.TPFSprite) #sprite.CSN
+            pageKey = (id(pxlMatch), id(searchCLUT), clutNumber, sprite.TPFSprite)
+            if pageKey not in pageRenders:
+                indexPlane, CLUT_ENTRIES = getIndexPlane(pxlMatch.PXLData, pxlMatch.W, pxlMatch.H, sprite.TPFSprite)
+                pageRenders[pageKey] = gatherIndexPlane(indexPlane, searchCLUT.CLUTs, clutNumber, CLUT_ENTRIES) #sprite.CSN
+            totalImage = pageRenders[pageKey]
             
-            spriteImage = totalImage.crop((sprite.u, sprite.v, sprite.u + spriteWidth, sprite.v + spriteHeight))
+            spriteArray = cropArray(totalImage, sprite.u, sprite.v, spriteWidth, spriteHeight)
+            spriteImage = Image.fromarray(np.ascontiguousarray(spriteArray), "RGBA")
 
             trueSpriteOffsetX = sprite.ofsX
             trueSpriteOffsetY = sprite.ofsY
@@ -748,70 +1003,19 @@ def animateANM(ANM, PXLs, CLUTs):
 
             #Perform transparency
             if sprite.ABE != 0:
-                if sprite.ABR == 0:
-                    #50F 50B
-                    foregroundAmount = 0.5
-                    backgroundAmount = 0.5    
-                elif sprite.ABR == 1:
-                    #100F 100B
-                    foregroundAmount = 1.0
-                    backgroundAmount = 1.0
-                elif sprite.ABR == 2:
-                    #-100F 100B
-                    foregroundAmount = -1.0
-                    backgroundAmount = 1.0
-                elif sprite.ABR == 3:
-                    #25F 100B
-                    foregroundAmount = 0.25
-                    backgroundAmount = 1.0
-                    pass
-                
-                for x in range(trueWidth):
-                    for y in range(trueHeight):
-                        
-                        if sprite.TPFSprite == FOUR_BIT_CLUT:
-                            CLUTEntries = 0x10
-                        elif sprite.TPFSprite == EIGHT_BIT_CLUT:
-                            CLUTEntries = 0x100
-                        pixel = spriteImage.getpixel((x,y))
-                        
-                        pixelArray = []
-                        for i in pixel:
-                            pixelArray.append(i >>3)
-                        
-                        pixelArray[3] = 1
-                        
-
-                        offset = clutNumber * CLUTEntries
-                        #Search for color with transparency bit set, and ignore if not found
-                        try:
-                            value = searchCLUT.CLUTs[offset:offset+CLUTEntries].index(pixelArray)
-                        except ValueError:
-                            continue
-
-                        
-                        CLUTColor = searchCLUT.CLUTs[offset + value]
-                        CLUTtransparencyBit = CLUTColor[3]
-
-                        if CLUTtransparencyBit != 1:
-                            continue
-
-                        foregroundPixel = spriteImage.getpixel((x,y))
-                        
-                        backgroundPixel = runningImage.getpixel((trueSpriteOffsetX + x, trueSpriteOffsetY + y ))
-                        
-                        red = foregroundPixel[0] * foregroundPixel[3]/255 * foregroundAmount + backgroundPixel[0] * backgroundAmount
-                        red = min(red, 255)
-                        red = max(red, 0)
-                        green = foregroundPixel[1] * foregroundPixel[3]/255 * foregroundAmount + backgroundPixel[1] * backgroundAmount
-                        green = min(green, 255)
-                        green = max(green, 0)
-                        blue = foregroundPixel[2] * foregroundPixel[3]/255 * foregroundAmount + backgroundPixel[2] * backgroundAmount
-                        blue = min(blue, 255)
-                        blue = max(blue, 0)
-                        alpha = max(foregroundPixel[3], backgroundPixel[3])
-                        
-                        spriteImage.putpixel((x,y), (int(red), int(green), int(blue), alpha))
+                if sprite.TPFSprite == FOUR_BIT_CLUT:
+                    CLUTEntries = 0x10
+                elif sprite.TPFSprite == EIGHT_BIT_CLUT:
+                    CLUTEntries = 0x100
+                offset = clutNumber * CLUTEntries
+
+                spriteArray = np.array(spriteImage)
+                #Only colours with the transparency bit set are blended
+                STPMask = getSTPMask(spriteArray, searchCLUT.CLUTs[offset:offset+CLUTEntries])
+                if STPMask.any():
+                    spriteArray = compositeABR(spriteArray, np.array(runningImage), trueSpriteOffsetX, trueSpriteOffsetY, sprite.ABR, STPMask)
+                    spriteImage = Image.fromarray(spriteArray, "RGBA")
+                    spriteImages[-1][0] = spriteImage
 
             runningImage.paste(spriteImage, (trueSpriteOffsetX, trueSpriteOffsetY), mask=spriteImage)
         
@@ -850,122 +1054,120 @@ def animateANM(ANM, PXLs, CLUTs):
 
 #Returns an ANM object as binary (bytes)
 def repackANM(ANM):
-    outputBuffer = b''
-
-    flagBuffer = 0
+    outputBuffer = bytearray(getANMSize(ANM))
+    repackANM_into(ANM, outputBuffer, 0)
+    return outputBuffer
 
+#Returns the size in bytes of an ANM object once repacked
+def getANMSize(ANM):
+    size = ANM_HEADER_RECORD.size + ANM_SEQUENCE_RECORD.size * len(ANM.sequences)
+    for spriteGroup in ANM.spriteGroups:
+        size += ANM_SPRITE_COUNT_RECORD.size + (ANM_SPRITE_RECORD.size + ANM_SPRITE_TAIL_RECORD.size) * spriteGroup.NSprite
+        size += ANM_SPRITE_SIZE_RECORD.size * int(np.count_nonzero(spriteGroup.sprites.THW == 0))
+    for CLUTGrp in ANM.CLUTGrps:
+        size += 12 + 2 * len(CLUTGrp.CLUTS)
+    return size
+
+#Writes an array of words into a buffer as little endian uint32s, returns the offset after them
+def packANMWords(words, buffer, offset):
+    assert words.size == 0 or (words.min() >= 0 and words.max() < 2**32), "ANM field out of range for its word"
+    wordBytes = words.astype('<u4').tobytes()
+    buffer[offset:offset + len(wordBytes)] = wordBytes
+    return offset + len(wordBytes)
+
+#Packs an ANM object into a writable buffer (bytearray, mmap or memoryview) at offset, returns the offset after it
+def repackANM_into(ANM, buffer, offset):
     ID = ANM.ID
     Version = ANM.version << 8
     TPF = ANM.TPF << 16
     NCLUTS = ANM.NCLUTS << 28
-    
-
-    outputBuffer += (ID + Version + TPF + NCLUTS).to_bytes(4, byteorder = 'little')
     NSPRITEGp = len(ANM.spriteGroups)
     NSEQUENCE = len(ANM.sequences) << 16
 
-    outputBuffer += (NSPRITEGp + NSEQUENCE).to_bytes(4, byteorder = 'little')
+    struct.pack_into('<II', buffer, offset, ID + Version + TPF + NCLUTS, NSPRITEGp + NSEQUENCE)
+    cursor = offset + 8
 
-    for sequence in ANM.sequences:
-        SprGpNo = sequence.spriteGrpNumber
-        time = sequence.time << 16
-        attr = sequence.attr << 28
+    #Each sequence is two words, built for all sequences at once
+    sequences = ANM.sequences.astype([(name, '<i8') for name in SEQUENCE_DTYPE.names]).view(np.recarray)
+    sequenceWords = np.empty((len(sequences), 2), dtype=np.int64)
+    sequenceWords[:, 0] = sequences.spriteGrpNumber + (sequences.time << 16) + (sequences.attr << 28)
+    sequenceWords[:, 1] = sequences.hotSpotX + (sequences.hotSpotY << 16)
+    cursor = packANMWords(sequenceWords, buffer, cursor)
 
-        outputBuffer += (SprGpNo + time + attr).to_bytes(4, byteorder = 'little')
-        
-        hotSpotX = sequence.hotSpotX
-        hotSpotY = sequence.hotSpotY << 16
-
-        outputBuffer += (hotSpotX + hotSpotY).to_bytes(4, byteorder = 'little')
-
-    
+    #Each sprite is five words, the size word is dropped for sprites with THW set
     for spriteGroup in ANM.spriteGroups:
-        NSprite = spriteGroup.NSprite
-        outputBuffer += (NSprite).to_bytes(4, byteorder = 'little')
-
-        for spriteNumber in range(NSprite):
-            u = spriteGroup.sprites[spriteNumber].u
-            v = spriteGroup.sprites[spriteNumber].v << 8
-            ofsX = spriteGroup.sprites[spriteNumber].ofsX << 16
-            ofsY = spriteGroup.sprites[spriteNumber].ofsY << 24
-
-            outputBuffer += (u + v + ofsX + ofsY).to_bytes(4, byteorder = 'little')
-
-            CLX = spriteGroup.sprites[spriteNumber].CLX
-            CLY = spriteGroup.sprites[spriteNumber].CLY << 6
-            ABE = spriteGroup.sprites[spriteNumber].ABE << 15
-            TPN = spriteGroup.sprites[spriteNumber].TexturePageNumber << 16
-            ABR = spriteGroup.sprites[spriteNumber].ABR << 21
-            TPFSprite = spriteGroup.sprites[spriteNumber].TPFSprite << 23
-            RSZ = spriteGroup.sprites[spriteNumber].RSZ << 26
-            ROT = spriteGroup.sprites[spriteNumber].ROT << 27
-            THW = spriteGroup.sprites[spriteNumber].THW << 28
-
-            outputBuffer += (CLX + CLY + ABE + TPN + ABR + TPFSprite + RSZ + ROT + THW).to_bytes(4, byteorder = 'little')
-
-            if THW == 0:
-                W = spriteGroup.sprites[spriteNumber].Width
-                H = spriteGroup.sprites[spriteNumber].Height << 16
-
-                outputBuffer += (W + H).to_bytes(4, byteorder = 'little')
-
-            rotationAngle = spriteGroup.sprites[spriteNumber].Rotation
-            Flag2Reserve = spriteGroup.sprites[spriteNumber].Flag2Reserve << 16
-            CSN = spriteGroup.sprites[spriteNumber].CSN << 24
-            BNO = spriteGroup.sprites[spriteNumber].BNO << 30
-            
-            outputBuffer += (Flag2Reserve + rotationAngle + CSN + BNO).to_bytes(4, byteorder = 'little')
-
-            X = spriteGroup.sprites[spriteNumber].XScaling
-            Y = spriteGroup.sprites[spriteNumber].YScaling << 16
-
-            outputBuffer += (X + Y).to_bytes(4, byteorder = 'little')
+        struct.pack_into('<I', buffer, cursor, spriteGroup.NSprite)
+        cursor += 4
+
+        sprites = spriteGroup.sprites.astype([(name, '<i8') for name in SPRITE_DTYPE.names]).view(np.recarray)
+        spriteWords = np.empty((len(sprites), 5), dtype=np.int64)
+        spriteWords[:, 0] = sprites.u + (sprites.v << 8) + (sprites.ofsX << 16) + (sprites.ofsY << 24)
+        spriteWords[:, 1] = (sprites.CLX + (sprites.CLY << 6) + (sprites.ABE << 15) + (sprites.TexturePageNumber << 16) + (sprites.ABR << 21)
+                             + (sprites.TPFSprite << 23) + (sprites.RSZ << 26) + (sprites.ROT << 27) + (sprites.THW << 28))
+        spriteWords[:, 2] = sprites.Width + (sprites.Height << 16)
+        spriteWords[:, 3] = (sprites.Flag2Reserve << 16) + sprites.Rotation + (sprites.CSN << 24) + (sprites.BNO << 30)
+        spriteWords[:, 4] = sprites.XScaling + (sprites.YScaling << 16)
+
+        wordMask = np.ones(spriteWords.shape, dtype=bool)
+        wordMask[:, 2] = sprites.THW == 0
+        cursor = packANMWords(spriteWords[wordMask], buffer, cursor)
 
     for CLUTGrp in ANM.CLUTGrps:
         CLUTbnum = CLUTGrp.bnum
-        outputBuffer += CLUTbnum.to_bytes(4, byteorder = 'little')
 
         DX = CLUTGrp.DX
         DY = CLUTGrp.DY << 16
-        outputBuffer += (DX + DY).to_bytes(4, byteorder = 'little')
 
         CLUTW = CLUTGrp.W
         CLUTH = CLUTGrp.H << 16
-        outputBuffer += (W + H).to_bytes(4, byteorder = 'little')
+        struct.pack_into('<III', buffer, cursor, CLUTbnum, DX + DY, CLUTW + CLUTH)
+        cursor += 12
 
-        for CLUTEntry in CLUTGrp.CLUTS:
-            red = CLUTEntry[0]
-            green = CLUTEntry[1] << 5
-            blue = CLUTEntry[2] << 10
-            alpha = CLUTEntry[3] << 15
+        CLUTBytes = np.asarray(CLUTGrp.CLUTS, dtype='<u2').tobytes()
+        buffer[cursor:cursor + len(CLUTBytes)] = CLUTBytes
+        cursor += len(CLUTBytes)
 
-            outputBuffer += (red + green + blue + alpha).to_bytes(2, byteorder = 'little')
-
-
-        
-
-    return outputBuffer
+    return cursor
 
 #Returns an array of x,y coords of pixels that mismatch in image 1 and 2
 def getDiffPixels(image1, image2):
-    changedPixels = []
+    changedY, changedX = np.nonzero(getDiffMask(image1, image2))
+    return [[int(x), int(y)] for x, y in zip(changedX, changedY)]
+
+#Returns a (height, width) bool array of the pixels that differ between two RGBA images, ignoring pixels transparent in both
+def getDiffMask(image1, image2):
     if image1.height != image2.height or image1.width != image2.width:
         assert False, "Image dimensions for diff must match"
 
-    for y in range(image1.height):
-        for x in range(image1.width):
-            if image1.getpixel((x,y))[3] == 0 and image2.getpixel((x,y))[3] == 0:
-                continue
-            elif not np.array_equal(image1.getpixel((x,y)),image2.getpixel((x,y))):
-                changedPixels += [[x,y]]
-    return changedPixels
+    pixels1 = np.asarray(image1)
+    pixels2 = np.asarray(image2)
+    bothTransparent = (pixels1[:, :, 3] == 0) & (pixels2[:, :, 3] == 0)
+    return np.any(pixels1 != pixels2, axis=2) & ~bothTransparent
+
+#Returns the CLUT index of every raw 5551 value, using the first matching entry like findCLTEntry
+def getCLUTIndices(CLUT, values):
+    entries, firstIndices = np.unique(np.asarray(CLUT), return_index=True)
+    positions = np.minimum(np.searchsorted(entries, values), len(entries) - 1)
+    missing = entries[positions] != values
+    if missing.any():
+        raise ValueError(str(int(values[missing][0])) + " is not in CLT")
+    return firstIndices[positions]
+
+#Groups sorted byte positions into [start, end) runs of consecutive bytes
+def getByteRuns(positions):
+    if len(positions) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(positions)]))
+    return [(int(positions[start]), int(positions[end - 1]) + 1) for start, end in zip(starts, ends)]
 
 #Replaces a PXL image using a new PNG and a reference PNG, and a given CLUT
-def injectPNG(originalPNGPath, newPNGPath, PXLPath, PXLOffset, CLUTFile, CLUTFileOffset, CLUTNumber):
+def injectPNG(originalPNGPath, newPNGPath, PXLPath, PXLOffset, CLUTFile, CLUTFileOffset, CLUTNumber, preview = False):
     newPNGImage = Image.open(newPNGPath).convert('RGBA')
     originalPNGImage = Image.open(originalPNGPath).convert('RGBA')
 
-    changedPixels = getDiffPixels(newPNGImage, originalPNGImage)
+    changedMask = getDiffMask(newPNGImage, originalPNGImage)
 
     if '4bit' in originalPNGPath:
         PMODE = FOUR_BIT_CLUT
@@ -977,62 +1179,83 @@ def injectPNG(originalPNGPath, newPNGPath, PXLPath, PXLOffset, CLUTFile, CLUTFil
 
     CLUT = getCLUT(open(CLUTFile, 'rb'), CLUTFileOffset, CLUTNumber, PMODE)
 
+    #Look up the CLUT index of every changed pixel at once
+    newPixels = np.asarray(newPNGImage).astype(np.uint16)
+    changedPixels = newPixels[changedMask]
+    searchPixels = encodeCLTEntry(changedPixels[:, 0] >> 3, changedPixels[:, 1] >> 3, changedPixels[:, 2] >> 3, 0)
+    newIndices = getCLUTIndices(CLUT, searchPixels)
+    pixelNumbers = np.flatnonzero(changedMask)
+
+    if PMODE == FOUR_BIT_CLUT:
+        dataSize = (changedMask.size + 1)//2
+    elif PMODE == EIGHT_BIT_CLUT:
+        dataSize = changedMask.size
+    elif PMODE == SIXTEEN_BIT_CLUT:
+        dataSize = changedMask.size*2
+
     PXLFile = open(PXLPath, 'r+b')
-  
-    
-    for changedPixel in changedPixels:
-        x = changedPixel[0]
-        y = changedPixel[1]
-        PXLFile.seek(PXLOffset + PXL_HEADER_SIZE)
-
-        if PMODE == EIGHT_BIT_CLUT:
-            PXLFile.read(x + originalPNGImage.width*y)
-            rawPixel = newPNGImage.getpixel((x,y))
-            searchPixel = [rawPixel[0] >>3, rawPixel[1] >>3, rawPixel[2] >>3, 0]
-            newPixel = CLUT.index(searchPixel)
-            PXLFile.write(newPixel.to_bytes(1, byteorder='little'))
-
-        elif PMODE == FOUR_BIT_CLUT:
-            pixelNumber = x + originalPNGImage.width*y
-            PXLFile.read(pixelNumber//2)
-            rawPixel = newPNGImage.getpixel((x,y))
-            searchPixel = [rawPixel[0] >>3, rawPixel[1] >>3, rawPixel[2] >>3, 0] #rawPixel[3]//255 ]
-            newPixel = CLUT.index(searchPixel)
-            charToEdit = int.from_bytes(PXLFile.read(1), byteorder='little')
-
-            if pixelNumber % 2 == 0:
-                charToEdit = (charToEdit & 0b11110000) | newPixel
-                #print("Editing pixel " + str(x) + ',' + str(y) + " (byte " + hex(PXLOffset + PXL_HEADER_SIZE + pixelNumber//2) + ") with value " + str(newPixel))
-            else:
-                charToEdit = (charToEdit & 0b00001111) | (newPixel << 4)
-                #print("Editing pixel " + str(x) + ',' + str(y) + " (byte " + hex(PXLOffset + PXL_HEADER_SIZE + pixelNumber//2) + ") with value " + str(newPixel))
-            PXLFile.seek(PXLOffset + PXL_HEADER_SIZE)
-            PXLFile.read(pixelNumber//2)
-            print(hex(PXLFile.tell()))
-            PXLFile.write(charToEdit.to_bytes(1, byteorder='little'))
-        elif PMODE == SIXTEEN_BIT_CLUT:
-            
-            PXLFile.read((x + originalPNGImage.width*y)*2)
-            rawPixel = newPNGImage.getpixel((x,y))
-            searchPixel = [rawPixel[0] >>3, rawPixel[1] >>3, rawPixel[2] >>3, 0]
-            newPixel = CLUT.index(searchPixel)
-            PXLFile.write(newPixel.to_bytes(2, byteorder='little'))
-            pass
+    PXLFile.seek(PXLOffset + PXL_HEADER_SIZE)
+    PXLData = PXLFile.read(dataSize)
+    PXLData = np.frombuffer(PXLData + bytes(dataSize - len(PXLData)), dtype=np.uint8).copy()
+
+    #Patch the pixel data in memory, merging nibbles for 4 bit
+    if PMODE == EIGHT_BIT_CLUT:
+        PXLData[pixelNumbers] = newIndices
+        changedBytes = pixelNumbers
+    elif PMODE == FOUR_BIT_CLUT:
+        isLowNibble = pixelNumbers % 2 == 0
+        lowBytes = pixelNumbers[isLowNibble]//2
+        highBytes = pixelNumbers[~isLowNibble]//2
+        PXLData[lowBytes] = (PXLData[lowBytes] & 0b11110000) | newIndices[isLowNibble]
+        PXLData[highBytes] = (PXLData[highBytes] & 0b00001111) | (newIndices[~isLowNibble] << 4)
+        changedBytes = np.unique(pixelNumbers//2)
+    elif PMODE == SIXTEEN_BIT_CLUT:
+        PXLData.view('<u2')[pixelNumbers] = newIndices
+        changedBytes = np.sort(np.concatenate((pixelNumbers*2, pixelNumbers*2 + 1)))
+
+    #Write each run of consecutive changed bytes in one call
+    byteRuns = getByteRuns(changedBytes)
+    for start, end in byteRuns:
+        PXLFile.seek(PXLOffset + PXL_HEADER_SIZE + start)
+        PXLFile.write(PXLData[start:end].tobytes())
+
+    PXLFile.close()
+    ImageHill.invalidateCache(PXLPath)
+    print("Patched " + str(len(pixelNumbers)) + " pixels in " + str(len(byteRuns)) + " writes")
+
+    if preview:
+        previewPixels = np.array(newPNGImage)
+        previewPixels[changedMask] = (255,0,0,255)
+        Image.fromarray(previewPixels, 'RGBA').show()
+    return
 
-            
 
-    for change in changedPixels:
-        newPNGImage.putpixel((change[0],change[1]), (255,0,0))
+#Produces an Image from a given PXL and CLUT, as RGBA or as P mode with the CLUT attached as palette
+def generatePNG(PXLs, CLTs, width, height, CLUT_Number, PMODE, paletteMode = False):
+    if not os.path.exists(OUTPUT_FOLDER):
+        os.mkdir(OUTPUT_FOLDER)
 
-    newPNGImage.show()
-    return
+    indexPlane, CLUT_ENTRIES = getIndexPlane(PXLs, width, height, PMODE)
+    im = renderIndexPlane(indexPlane, CLTs, CLUT_Number, CLUT_ENTRIES, paletteMode)
+    #im.show()
 
+    return im
 
-#Produces an Image from a given PXL and CLUT
-def generatePNG(PXLs, CLTs, width, height, CLUT_Number, PMODE):
+#Produces one Image per CLUT number from a given PXL, decoding the pixel indices only once
+def generatePNGs(PXLs, CLTs, width, height, CLUT_Numbers, PMODE, paletteMode = False):
     if not os.path.exists(OUTPUT_FOLDER):
         os.mkdir(OUTPUT_FOLDER)
 
+    indexPlane, CLUT_ENTRIES = getIndexPlane(PXLs, width, height, PMODE)
+
+    images = []
+    for CLUT_Number in CLUT_Numbers:
+        images.append(renderIndexPlane(indexPlane, CLTs, CLUT_Number, CLUT_ENTRIES, paletteMode))
+
+    return images
+
+#Lays out PXL entries as a (height, pixel width) uint8 array and returns it with the CLUT size for the PMODE
+def getIndexPlane(PXLs, width, height, PMODE):
     if PMODE == FOUR_BIT_CLUT:
         CLUT_ENTRIES = 0x10
         width = width * 4
@@ -1045,57 +1268,84 @@ def generatePNG(PXLs, CLTs, width, height, CLUT_Number, PMODE):
         CLUT_ENTRIES = 0x10
         width = width * 4
 
-    arrayBuffer = np.zeros((height, width, 4), dtype=np.uint8)
-
-    
-    CLUT_Offset = CLUT_Number * CLUT_ENTRIES
-
+    #Pixels past the end of the PXL data stay at index 0
+    indexPlane = np.zeros(height * width, dtype=np.uint8)
+    PXLs = np.asarray(PXLs, dtype=np.uint8)[:height * width]
+    indexPlane[:PXLs.size] = PXLs
 
-    for pixelNumber in range(len(PXLs)):
-        value = PXLs[pixelNumber]
+    return indexPlane.reshape((height, width)), CLUT_ENTRIES
 
-        CLUT_Entry = CLUT_Offset + value
-        
-        red   = CLTs[CLUT_Entry][0] << 3
-        green = CLTs[CLUT_Entry][1] << 3
-        blue  = CLTs[CLUT_Entry][2] << 3
-        alpha = CLTs[CLUT_Entry][3] << 3
-        
-        if red == green == blue == alpha == 0:
-            alpha = 0
-        else:
-            alpha = 255
-
-        
-        rowNumber    = pixelNumber//width
-        columnNumber = pixelNumber % width
-        arrayBuffer[rowNumber][columnNumber] = (red, green, blue, alpha)
-
-        #if rowNumber == columnNumber:
-        #    print("Pixel " + str(rowNumber) + ": " + str((red, green, blue, alpha)))
+#Renders an index plane through one CLUT of a CLT with a single palette gather
+def renderIndexPlane(indexPlane, CLTs, CLUT_Number, CLUT_ENTRIES, paletteMode = False):
+    if paletteMode:
+        im = Image.fromarray(indexPlane, "L")
+        im = im.convert("P")
+        im.putpalette(getCLUTPalette(CLTs, CLUT_Number, CLUT_ENTRIES).tobytes(), "RGBA")
+        return im
 
+    return Image.fromarray(gatherIndexPlane(indexPlane, CLTs, CLUT_Number, CLUT_ENTRIES), "RGBA")
 
-    im = Image.fromarray(arrayBuffer, "RGBA")
-    #im.show()
-
-    return im
+#Returns the RGBA palette of one CLUT in a CLT, padded to CLUT_ENTRIES colors
+def getCLUTPalette(CLTs, CLUT_Number, CLUT_ENTRIES):
+    CLUT_Offset = CLUT_Number * CLUT_ENTRIES
+    palette = np.zeros((CLUT_ENTRIES, 4), dtype=np.uint8)
+    CLUTPalette = decodeCLTEntries(CLTs[CLUT_Offset:CLUT_Offset + CLUT_ENTRIES])
+    palette[:len(CLUTPalette)] = CLUTPalette
+    return palette
+
+#Returns an index plane rendered through one CLUT as a (height, width, 4) RGBA array
+def gatherIndexPlane(indexPlane, CLTs, CLUT_Number, CLUT_ENTRIES):
+    return getCLUTPalette(CLTs, CLUT_Number, CLUT_ENTRIES)[indexPlane]
+
+#Returns a width x height window of an image array, as a view when it lies inside the array and zero padded otherwise
+def cropArray(array, left, top, width, height):
+    if left >= 0 and top >= 0 and left + width <= array.shape[1] and top + height <= array.shape[0]:
+        return array[top:top + height, left:left + width]
+
+    cropped = np.zeros((height, width) + array.shape[2:], dtype=array.dtype)
+    sourceLeft, sourceTop = max(left, 0), max(top, 0)
+    sourceRight, sourceBottom = min(left + width, array.shape[1]), min(top + height, array.shape[0])
+    if sourceRight > sourceLeft and sourceBottom > sourceTop:
+        cropped[sourceTop - top:sourceBottom - top, sourceLeft - left:sourceRight - left] = array[sourceTop:sourceBottom, sourceLeft:sourceRight]
+    return cropped
+
+#Returns a (height, width) mask of the sprite pixels whose colour is a CLUT entry with the STP bit set
+def getSTPMask(spriteArray, CLUTEntries):
+    spriteArray = spriteArray.astype(np.uint16)
+    pixelEntries = (spriteArray[..., 0] >> 3) | ((spriteArray[..., 1] >> 3) << 5) | ((spriteArray[..., 2] >> 3) << 10) | 0x8000
+    STPEntries = CLUTEntries[(CLUTEntries >> 15) == 1]
+    return np.isin(pixelEntries, STPEntries)
+
+#Blends the masked sprite pixels with the background under them using the PS1 ABR rates, returns the new sprite array
+def compositeABR(spriteArray, backgroundArray, offsetX, offsetY, ABR, STPMask):
+    foregroundAmount, backgroundAmount = ABR_RATES[ABR]
+    height, width = spriteArray.shape[:2]
+
+    #Negative offsets wrap around the background like getpixel does
+    rows = (offsetY + np.arange(height)) % backgroundArray.shape[0]
+    columns = (offsetX + np.arange(width)) % backgroundArray.shape[1]
+    background = backgroundArray[rows[:, None], columns[None, :]].astype(np.float64)
+    foreground = spriteArray.astype(np.float64)
+
+    blended = foreground[..., :3] * foreground[..., 3:4] / 255 * foregroundAmount + background[..., :3] * backgroundAmount
+    blended = np.clip(blended, 0, 255).astype(np.uint8)
+    alpha = np.maximum(spriteArray[..., 3], background[..., 3].astype(np.uint8))
+
+    compositedArray = spriteArray.copy()
+    compositedArray[STPMask, :3] = blended[STPMask]
+    compositedArray[STPMask, 3] = alpha[STPMask]
+    return compositedArray
 
 #Returns the offsets to idividual files in a pac file
 def getPacOffsets(file):
 
-    pacFile = open(os.path.join(SOURCE_FOLDER,file), "rb")
-
-    numEntries = int.from_bytes(pacFile.read(4), byteorder='little')
-
-    offsets = []
-    for entry in range(numEntries):
-        offsets += [int.from_bytes(pacFile.read(4), byteorder='little')]
+    with PacArchive(os.path.join(SOURCE_FOLDER,file)) as pacArchive:
+        offsets = pacArchive.offsets
 
     return offsets
 
-
 #Extracts every specified PXL and CLT pair into PNG files
-def unpackImages(outdir):
+def unpackImages(outdir, paletteMode = False):
     for image in IMAGES:
         PXLPath = image[0]
         CLTPath = image[1]
@@ -1104,7 +1354,7 @@ def unpackImages(outdir):
 
         for offset in offsets:
             print("Extracting", PXLPath, hex(offset))
-            extractImage(os.path.join(BASE_FOLDER,PXLPath), offset, os.path.join(BASE_FOLDER,CLTPath), 0, outdir)
+            extractImage(os.path.join(BASE_FOLDER,PXLPath), offset, os.path.join(BASE_FOLDER,CLTPath), 0, outdir, paletteMode)
 
 
     return
@@ -1126,9 +1376,9 @@ def generateImageFilePath(path, CLUT_Number, outdir, CLT_name,  offset, PMODE):
 
 
 #Turns a PXL and corresponding palette file into their corresponding PNG images
-def extractImage(PXLFilePath, PXLFileOffest, CLTFilePath, CLTFileOffset, outdir):
+def extractImage(PXLFilePath, PXLFileOffest, CLTFilePath, CLTFileOffset, outdir, paletteMode = False):
     PXLFile = open(PXLFilePath, 'rb')
-    PXLFile.read(PXLFileOffest)
+    PXLFile.seek(PXLFileOffest)
     
     PXL_ID    = readInt(PXLFile)
     PXL_PMODE = readInt(PXLFile)
@@ -1140,7 +1390,7 @@ def extractImage(PXLFilePath, PXLFileOffest, CLTFilePath, CLTFileOffset, outdir)
     
     CLT_name = os.path.basename(CLTFilePath)
     CLTFile = open(CLTFilePath, 'rb')
-    CLTFile.read(CLTFileOffset)
+    CLTFile.seek(CLTFileOffset)
 
     CLT_ID    = readInt(CLTFile)
     CLT_PMODE = readInt(CLTFile)
@@ -1151,8 +1401,10 @@ def extractImage(PXLFilePath, PXLFileOffest, CLTFilePath, CLTFileOffset, outdir)
     CLT_H     = readShort(CLTFile)
     
 
-    PXLs = readPXLEntries(PXLFile, PXL_PMODE, PXL_bnum - 0xC)
-    CLTs = readCLTEntries(CLTFile, (CLT_bnum - 0xC)//2)
+    PXLs = ImageHill.getCached(PXLFilePath, PXLFileOffest, "PXLEntries", lambda: readPXLEntries(PXLFile, PXL_PMODE, PXL_bnum - 0xC))
+    CLTs = ImageHill.getCached(CLTFilePath, CLTFileOffset, "CLTEntries", lambda: readCLTEntries(CLTFile, (CLT_bnum - 0xC)//2))
+    PXLFile.close()
+    CLTFile.close()
     
     if PXL_PMODE == FOUR_BIT_CLUT:
         CLUT_SIZE = 0x20
@@ -1162,8 +1414,9 @@ def extractImage(PXLFilePath, PXLFileOffest, CLTFilePath, CLTFileOffset, outdir)
 
     CLUT_COUNT = (CLT_bnum - 0xC)//CLUT_SIZE
 
+    images = generatePNGs(PXLs, CLTs, PXL_W, PXL_H, range(CLUT_COUNT), PXL_PMODE, paletteMode)
     for CLUT_Number in range(CLUT_COUNT):
-        image = generatePNG(PXLs, CLTs, PXL_W, PXL_H, CLUT_Number, PXL_PMODE)
+        image = images[CLUT_Number]
         image.save(generateImageFilePath(PXLFilePath, CLUT_Number, outdir, CLT_name, PXLFileOffest, PXL_PMODE))
     
 
@@ -1272,212 +1525,318 @@ def getLetterTable(tableFilePath):
 
 #Returns the left and right borders of each letter in the font
 def getLetterCoords(fontImage, letterTable, fontColumns, fontHeight, fontCLUT, kerning = 0):
-    
-    letterCoords = []
+    fontPixels = np.asarray(fontImage.convert("RGBA"))
+
+    #Metrics depend only on the font pixels, the table, the CLUT and the kerning
+    metricsKey = hashlib.sha256(fontPixels.tobytes() + repr((fontPixels.shape, letterTable, fontColumns, fontHeight, fontCLUT, kerning)).encode("UTF8")).hexdigest()
+    letterMetrics = loadLetterMetrics()
+    if metricsKey in letterMetrics:
+        return [list(letterCoord) for letterCoord in letterMetrics[metricsKey]]
+
+    tileWidth = fontPixels.shape[1]//fontColumns
+    fontRows = (len(letterTable) + fontColumns - 1)//fontColumns
+
+    #A pixel is ink when it is neither transparent nor the CLUT alpha colour
+    alphaColor = fontCLUT[0]
+    inkPixels = fontPixels[:, :, 3] != 0
+    if len(alphaColor) == 4:
+        inkPixels &= ~np.all(fontPixels == alphaColor, axis=2)
+
+    #Tiles past the edge of the font image are blank, like crop's padding
+    paddedInk = np.zeros((fontRows*fontHeight, fontColumns*tileWidth), dtype=bool)
+    copyHeight = min(paddedInk.shape[0], inkPixels.shape[0])
+    paddedInk[:copyHeight] = inkPixels[:copyHeight, :fontColumns*tileWidth]
+
+    #Columns holding ink for every tile, in letter number order
+    inkColumns = paddedInk.reshape((fontRows, fontHeight, fontColumns, tileWidth)).any(axis=1).reshape((fontRows*fontColumns, tileWidth))[:len(letterTable)]
+    leftHandBorders = np.argmax(inkColumns, axis=1)
+    rightHandBorders = tileWidth - 1 - np.argmax(inkColumns[:, ::-1], axis=1)
+    isBlank = ~inkColumns.any(axis=1)
 
+    letterCoords = []
     for letterNumber in range(len(letterTable)):
-        rowNumber = letterNumber//fontColumns
-        colNumber = letterNumber % fontColumns
-        fontWidth = fontImage.width
-
-        tileWidth = fontWidth//fontColumns
-        topLeftCoord = tileWidth*colNumber, fontHeight*rowNumber
-        bottomRightCoord = tileWidth*(colNumber+1), fontHeight*(rowNumber+1)
-
-        characterTile = fontImage.crop((topLeftCoord + bottomRightCoord))
-
-        alphaColor = fontCLUT[0]
-
-        #Check how many blank left-hand columns exist
-        leftHandBorderFound = False
-        rightHandBorderFound = False
-        for x in range(tileWidth):
-            for y in range(fontHeight):
-                if characterTile.getpixel((x,y))[3] == 0:
-                    continue
-                if characterTile.getpixel((x,y)) != alphaColor:
-                    leftHandBorder = x
-                    leftHandBorderFound = True
-                    break
-            if leftHandBorderFound == True:
-                break
-                
         #Letter is blank
-        if not leftHandBorderFound:
+        if isBlank[letterNumber]:
             letterCoords.append([0,0])
-            continue
-        
-        #Check how many blank right-hand columns exist
-        for x in reversed(range(tileWidth)):
-            for y in range(fontHeight):
-                if characterTile.getpixel((x,y))[3] == 0:
-                    continue
-                if characterTile.getpixel((x,y)) != alphaColor:
-                    rightHandBorder = x
-                    rightHandBorderFound = True
-                    break
-            if rightHandBorderFound == True:
-                break
-
-        letterCoords.append([leftHandBorder,rightHandBorder + kerning])
-
-    return letterCoords
+        else:
+            letterCoords.append([int(leftHandBorders[letterNumber]), int(rightHandBorders[letterNumber]) + kerning])
+
+    letterMetrics[metricsKey] = letterCoords
+    saveLetterMetrics(letterMetrics)
+    return [list(letterCoord) for letterCoord in letterCoords]
+
+LETTER_METRICS = None
+
+#Returns the cached letter metrics, loading them from disk on first use
+def loadLetterMetrics():
+    global LETTER_METRICS
+    if LETTER_METRICS is None:
+        LETTER_METRICS = {}
+        if os.path.exists(LETTER_METRICS_PATH):
+            with open(LETTER_METRICS_PATH, "r") as metricsFile:
+                LETTER_METRICS = json.load(metricsFile)
+    return LETTER_METRICS
+
+def saveLetterMetrics(letterMetrics):
+    tempPath = LETTER_METRICS_PATH + ".tmp"
+    with open(tempPath, "w") as metricsFile:
+        json.dump(letterMetrics, metricsFile)
+    os.replace(tempPath, LETTER_METRICS_PATH)
 
 #Finds locations to put words in the specified free areas and returns the coordinates, and the remaining areas
 def arrangeTextIntoImage(wordList, insertionAreas, fontImage, fontColumns, fontHeight, tableFilePath, fontCLUT, kerning = 0):
     
-    wordCoordinates = []
+    wordCoordinates = [None] * len(wordList)
 
-    numRowsList = []
-    widthsRemaining = []
-    #Find number of rows that the font can fit for each insertion area
-    for insertionArea in insertionAreas:
-        
+    #Rows of every insertion area as [area number, row number, width remaining]
+    rows = []
+    for insertionAreaNumber in range(len(insertionAreas)):
+        insertionArea = insertionAreas[insertionAreaNumber]
         insertionAreaHeight = insertionArea[1][1] - insertionArea[0][1]
         numRows = insertionAreaHeight//fontHeight
-        numRowsList.append(numRows)
-
-        #Initialize remaining widths for each available row
-        widthsRemainingCurrentArea = []
-        for i in range(numRows):
-            widthsRemainingCurrentArea.append(insertionArea[1][0] - insertionArea[0][0])
-
-        widthsRemaining.append(widthsRemainingCurrentArea)
+        for row in range(numRows):
+            rows.append([insertionAreaNumber, row, insertionArea[1][0] - insertionArea[0][0]])
 
     letterTable = getLetterTable(tableFilePath)
     letterWidths = getLetterCoords(fontImage, letterTable, fontColumns, fontHeight, fontCLUT, kerning)
     
-
-    #Find next available position for word and add to return list
+    #Find word width and bounds for each letter
+    wordWidths = []
+    wordBounds = []
     for word in wordList:
-        
-    #    for searchWord in wordList:
-    #        if word in searchWord and word != searchWord:
-    #            wordIndex = searchWord.indexWord
-
-        #Find word width and bounds for each letter
-        wordWidth = 0
         letterBounds = []
         for letter in word:
             letterCoordinate = letterTable.index(letter)
-            #Letter width = right hand - left hand + 1
-            letterWidth = letterWidths[letterCoordinate][1] - letterWidths[letterCoordinate][0] + 1
-            wordWidth += letterWidth
             letterBounds.append([letterWidths[letterCoordinate][0], letterWidths[letterCoordinate][1]])
-        
-        wordWidth += (4 - (wordWidth%4))%4 #CHECK THISSSS
-        isWidthFound = False
-        #Check each insertion area row by row until space is found to fit it
-        for insertionAreaNumber in range(len(insertionAreas)):
-            for row in range(numRowsList[insertionAreaNumber]):
-                
-                if wordWidth <= widthsRemaining[insertionAreaNumber][row]:
-                    insertionCoordinate = insertionAreas[insertionAreaNumber][1][0] - widthsRemaining[insertionAreaNumber][row]
-                    #Insertion area number, X, Y, letter bounds list for word
-                    wordCoordinates.append([insertionAreaNumber, insertionCoordinate, row*fontHeight +  insertionAreas[insertionAreaNumber][0][1], letterBounds])
-                    widthsRemaining[insertionAreaNumber][row] -= wordWidth
-                    isWidthFound = True
-                    break
-            
-            if isWidthFound:
-                break
+        wordWidths.append(sum(getLetterBoundWidth(letterBound) for letterBound in letterBounds))
+        wordBounds.append(letterBounds)
+
+    #Best fit decreasing, widest words first into the row that leaves the least space
+    placedWords = []
+    unplacedWords = []
+    for wordNumber in sorted(range(len(wordList)), key=lambda wordNumber: -getPaddedWidth(wordWidths[wordNumber])):
+        word = wordList[wordNumber]
+        letterBounds = wordBounds[wordNumber]
+
+        #Words drawn inside an already placed word reuse its pixels
+        reusedCoordinate = findPlacedSubstring(word, letterBounds, wordWidths[wordNumber], placedWords, wordList, wordWidths, wordCoordinates)
+        if reusedCoordinate is not None:
+            wordCoordinates[wordNumber] = reusedCoordinate
+            continue
 
-        assert isWidthFound, "No space left to insert word " + word
+        paddedWidth = getPaddedWidth(wordWidths[wordNumber])
+        bestRow = None
+        for row in rows:
+            if paddedWidth <= row[2] and (bestRow is None or row[2] < bestRow[2]):
+                bestRow = row
+
+        if bestRow is None:
+            unplacedWords.append(word)
+            continue
+
+        insertionAreaNumber = bestRow[0]
+        insertionCoordinate = insertionAreas[insertionAreaNumber][1][0] - bestRow[2]
+        #Insertion area number, X, Y, letter bounds list for word
+        wordCoordinates[wordNumber] = [insertionAreaNumber, insertionCoordinate, bestRow[1]*fontHeight + insertionAreas[insertionAreaNumber][0][1], letterBounds]
+        bestRow[2] -= paddedWidth
+        placedWords.append(wordNumber)
+
+    #Report how much of each insertion area the text uses
+    for insertionAreaNumber in range(len(insertionAreas)):
+        insertionArea = insertionAreas[insertionAreaNumber]
+        areaWidth = insertionArea[1][0] - insertionArea[0][0]
+        areaSize = areaWidth * (insertionArea[1][1] - insertionArea[0][1])
+        usedSize = sum(areaWidth - row[2] for row in rows if row[0] == insertionAreaNumber) * fontHeight
+        if areaSize > 0:
+            print("Insertion area " + str(insertionAreaNumber) + " fill ratio: " + "{:.1%}".format(usedSize/areaSize))
+    print(str(len(wordList) - len(placedWords) - len(unplacedWords)) + " of " + str(len(wordList)) + " words reuse a placed word's pixels")
+
+    assert len(unplacedWords) == 0, "No space left to insert words " + str(unplacedWords)
             
 
     return wordCoordinates
 
+#Letter width = right hand - left hand + 1
+def getLetterBoundWidth(letterBound):
+    return letterBound[1] - letterBound[0] + 1
+
+#Sprite widths are padded to a multiple of 4
+def getPaddedWidth(width):
+    return width + (4 - (width%4))%4 #CHECK THISSSS
+
+#Returns the coordinate of a word inside an already placed word with the same letter bounds, or None
+#The padding after the word must land on blank pixels, so it either needs none or ends with the placed word
+def findPlacedSubstring(word, letterBounds, wordWidth, placedWords, wordList, wordWidths, wordCoordinates):
+    padding = getPaddedWidth(wordWidth) - wordWidth
+    for placedWordNumber in placedWords:
+        placedWord = wordList[placedWordNumber]
+        placedCoordinate = wordCoordinates[placedWordNumber]
+        placedPadding = getPaddedWidth(wordWidths[placedWordNumber]) - wordWidths[placedWordNumber]
+
+        letterIndex = placedWord.find(word)
+        while letterIndex != -1:
+            if placedCoordinate[3][letterIndex:letterIndex + len(word)] == letterBounds:
+                wordOffset = sum(getLetterBoundWidth(letterBound) for letterBound in placedCoordinate[3][:letterIndex])
+                endsPlacedWord = letterIndex + len(word) == len(placedWord)
+                if padding == 0 or (endsPlacedWord and padding <= placedPadding):
+                    return [placedCoordinate[0], placedCoordinate[1] + wordOffset, placedCoordinate[2], letterBounds]
+            letterIndex = placedWord.find(word, letterIndex + 1)
+    return None
+
 #Edits the PXL or TIM target files with the given pixel coordinates and values
-def applyImageEdit(pixels, images, TPNs):
+#Returns the pixel data offset, PMode, width in pixels and height of a PXL or TIM image
+def readImageEditHeader(imagePath, imageOffset):
+    imageFile = open(imagePath, 'rb')
+    imageFile.seek(imageOffset)
+    id = readInt(imageFile)
 
-    imageFiles = []
-    imageWidths = []
     
-    ImageTPNs = []
-    for image in images:
-        TPN = image[2]
-        ImageTPNs.append(TPN)
+    #Clear TIM file to PXL data
+    if id == TIM_ID:
+        flag = readInt(imageFile)
+        PMode = flag & 0b111
+        CLUTFlag = (flag & 0b1000) >> 3 
 
-    for imagePathNumber in range(len(images)):
-        imageFile = open(images[imagePathNumber][0], 'r+b')
-        imageFiles.append(imageFile)
-        imageFile.read(images[imagePathNumber][1])
-        id = readInt(imageFile)
+        PXLOffset = 0x14
 
-        
-        #Clear TIM file to PXL data
-        if id == TIM_ID:
-            flag = readInt(imageFile)
-            PMode = flag & 0b111
-            CLUTFlag = (flag & 0b1000) >> 3 
 
-            PXLOffset = 0x14
+        if CLUTFlag == 1:
+            CLUTBnum = readInt(imageFile)
+            imageFile.seek(CLUTBnum - 4, os.SEEK_CUR)
+            PXLOffset += CLUTBnum
 
+    #Clear PXL header
+    else:
+        PXLOffset = 0x14
+        flag = readInt(imageFile)
+        PMode = flag & 0b1
+
+    imageFile.read(8)
+    if PMode < 3:
+        widthFactor = 2-PMode
+        width = readShort(imageFile) * (2**widthFactor)
+    else:
+        width = (readShort(imageFile) * 3) //2
+    height = readShort(imageFile)
+    imageFile.close()
+
+    return PXLOffset, PMode, width, height
+
+#Sets pixels of an edit plane and its write mask, pixels past the end of a row run into the next one like the image data does
+def setEditPixels(plane, mask, x, y, values):
+    pixelNumbers = (np.asarray(y) * plane.shape[1] + np.asarray(x)).reshape(-1)
+    values = np.broadcast_to(values, np.shape(x)).reshape(-1)
+    inImage = (pixelNumbers >= 0) & (pixelNumbers < plane.size)
+    if not inImage.all():
+        print("[WARNING] " + str(np.count_nonzero(~inImage)) + " edit pixels fall outside the target image and were dropped")
+    plane.reshape(-1)[pixelNumbers[inImage]] = values[inImage]
+    mask.reshape(-1)[pixelNumbers[inImage]] = True
+
+#Writes one (height, width) index plane per target image, only where its write mask is set
+def applyImageEdit(planes, masks, images):
+
+    for imageNumber in range(len(images)):
+        if not masks[imageNumber].any():
+            continue
 
-            if CLUTFlag == 1:
-                CLUTBnum = readInt(imageFile)
-                imageFile.read(CLUTBnum - 4)
-                PXLOffset += CLUTBnum
-
-        #Clear PXL header
-        else:
-            PXLOffset = 0x14
-            flag = readInt(imageFile)
-            PMode = flag & 0b1
-
-        imageFile.read(8)
-        if PMode < 3:
-            widthFactor = 2-PMode
-            width = readShort(imageFile) * (2**widthFactor)
-        else:
-            width = (readShort(imageFile) * 3) //2
-        imageWidths.append(width)
-        height = readShort(imageFile)
-
-    for pixel in pixels:
-        pixelX = pixel[0]
-        pixelY = pixel[1]
-        pixelValue = pixel[2]
-        pixelInsertionArea = ImageTPNs.index(TPNs[pixel[3]])
-
-        imageFiles[pixelInsertionArea].seek(images[pixelInsertionArea][1] + PXLOffset)
-
-        imageWidth = imageWidths[pixelInsertionArea]
+        imagePath = images[imageNumber][0]
+        imageOffset = images[imageNumber][1]
+        PXLOffset, PMode, width, height = readImageEditHeader(imagePath, imageOffset)
+        plane = planes[imageNumber]
+        mask = masks[imageNumber]
 
         if PMode == FOUR_BIT_CLUT:
-            evenness = pixelX%2 #WARNING, image width must be even
-            pixelOffset = (pixelY * (imageWidth//2) + pixelX//2) + images[pixelInsertionArea][1]  + PXLOffset
-            imageFiles[pixelInsertionArea].seek(pixelOffset)
-
-            charToEdit = readByte(imageFiles[pixelInsertionArea])
-            if evenness == 0:
-                byteToAdd = (charToEdit & 0b11110000) |  pixelValue
-            else:
-                byteToAdd = (charToEdit & 0b00001111) | (pixelValue << 4)
-            
-            pixelOffset = (pixelY * (imageWidth//2) + pixelX//2) + images[pixelInsertionArea][1]  + PXLOffset
-
-            imageFiles[pixelInsertionArea].seek(pixelOffset)
-            imageFiles[pixelInsertionArea].write(byteToAdd.to_bytes(1, byteorder='little'))
-        
+            dataSize = height * (width//2)
         elif PMode == EIGHT_BIT_CLUT:
-            pixelOffset = (pixelY * (imageWidth) + pixelX) + images[pixelInsertionArea][1] + PXLOffset
-            imageFiles[pixelInsertionArea].seek(pixelOffset)
-            imageFiles[pixelInsertionArea].write(pixelValue.to_bytes(1, byteorder='little'))
+            dataSize = height * width
         elif PMode == SIXTEEN_BIT_CLUT:
-            pixelOffset = (pixelY * (imageWidth*2) + pixelX*2) + images[pixelInsertionArea][1]  + PXLOffset
-            imageFiles[pixelInsertionArea].seek(pixelOffset)
-            imageFiles[pixelInsertionArea].write(pixelValue.to_bytes(2, byteorder='little'))
+            dataSize = height * width * 2
         elif PMode == TWENTYFOUR_BIT_CLUT:
-            pixelOffset = (pixelY * (imageWidth*3) + pixelX*3) + images[pixelInsertionArea][1] + PXLOffset
-            imageFiles[pixelInsertionArea].seek(pixelOffset)
-            imageFiles[pixelInsertionArea].write(pixelValue.to_bytes(3, byteorder='little'))
+            dataSize = height * width * 3
+
+        imageFile = open(imagePath, 'r+b')
+        imageFile.seek(imageOffset + PXLOffset)
+        oldData = imageFile.read(dataSize)
+        oldData = np.frombuffer(oldData + bytes(dataSize - len(oldData)), dtype=np.uint8)
 
-    for file in imageFiles:
-        file.close()
+        #Pack the plane, keeping the old pixels wherever the mask is clear
+        if PMode == FOUR_BIT_CLUT:
+            oldData = oldData.reshape((height, width//2))
+            lowNibbles = np.where(mask[:, 0::2], plane[:, 0::2], oldData & 0b00001111)
+            highNibbles = np.where(mask[:, 1::2], plane[:, 1::2], oldData >> 4)
+            newData = ((lowNibbles & 0b00001111) | (highNibbles << 4)).astype(np.uint8)
+            changedBytes = mask[:, 0::2] | mask[:, 1::2]
+        else:
+            bytesPerPixel = dataSize // (height * width)
+            shifts = np.arange(bytesPerPixel) * 8
+            planeBytes = ((plane[:, :, np.newaxis] >> shifts) & 0xFF).astype(np.uint8).reshape((height, width*bytesPerPixel))
+            byteMask = np.repeat(mask, bytesPerPixel, axis=1)
+            newData = np.where(byteMask, planeBytes, oldData.reshape((height, width*bytesPerPixel)))
+            changedBytes = byteMask
+
+        newData = newData.reshape(-1)
+        for start, end in getByteRuns(np.flatnonzero(changedBytes)):
+            imageFile.seek(imageOffset + PXLOffset + start)
+            imageFile.write(newData[start:end].tobytes())
+
+        imageFile.close()
+        ImageHill.invalidateCache(imagePath)
 
     return
 
+#Sets a rectangle of an edit plane and its write mask, as a slice when it fits inside the plane
+def blitEditPlane(plane, mask, left, top, values):
+    height, width = values.shape
+    if left >= 0 and top >= 0 and left + width <= plane.shape[1] and top + height <= plane.shape[0]:
+        plane[top:top + height, left:left + width] = values
+        mask[top:top + height, left:left + width] = True
+        return
+
+    valueY, valueX = np.mgrid[0:height, 0:width]
+    setEditPixels(plane, mask, left + valueX, top + valueY, values)
+
+class GlyphAtlas:
+    '''A font PNG converted once into fontCLUT indices, handing out glyphs trimmed to their letter bounds'''
+    def __init__(self, fontImagePath, fontCLUT, fontColumns, fontHeight):
+        fontPixels = np.asarray(Image.open(fontImagePath).convert("RGBA"))
+        self.indices = mapFontPixels(fontPixels, fontCLUT).astype(np.uint8)
+        self.tileWidth = fontPixels.shape[1]//fontColumns
+        self.fontColumns = fontColumns
+        self.fontHeight = fontHeight
+        self.glyphs = {}
+
+    #Returns the index array of a letter between its left and right bounds, inclusive
+    def getGlyph(self, letterNumber, letterBound):
+        key = (letterNumber, letterBound[0], letterBound[1])
+        if key not in self.glyphs:
+            letterXStart = (letterNumber % self.fontColumns) * self.tileWidth
+            letterYStart = (letterNumber // self.fontColumns) * self.fontHeight
+            self.glyphs[key] = self.indices[letterYStart:letterYStart + self.fontHeight, letterXStart + letterBound[0]:letterXStart + letterBound[1] + 1]
+        return self.glyphs[key]
+
+    #Returns the index array of a whole word, its letters placed side by side
+    def getWord(self, letterNumbers, letterBounds):
+        glyphs = [self.getGlyph(letterNumbers[letterIndex], letterBounds[letterIndex]) for letterIndex in range(len(letterNumbers))]
+        return np.hstack(glyphs)
+
+#Returns the glyph atlas of a font, shared by every inject stage using the same font file and CLUT
+def getGlyphAtlas(fontImagePath, fontCLUT, fontColumns, fontHeight):
+    atlasKind = "GlyphAtlas" + repr((fontCLUT, fontColumns, fontHeight))
+    return ImageHill.getCached(fontImagePath, 0, atlasKind, lambda: GlyphAtlas(fontImagePath, fontCLUT, fontColumns, fontHeight))
+
+#Returns the fontCLUT index of every pixel in an RGBA font array, 0 for colours missing from the CLUT
+def mapFontPixels(fontPixels, fontCLUT):
+    fontPixels = np.where(fontPixels[:, :, 3:4] == 0, 0, fontPixels)
+    values = np.zeros(fontPixels.shape[:2], dtype=np.uint32)
+    matched = np.zeros(fontPixels.shape[:2], dtype=bool)
+    for colorNumber in range(len(fontCLUT)):
+        if len(fontCLUT[colorNumber]) != 4:
+            continue
+        hit = np.all(fontPixels == fontCLUT[colorNumber], axis=2) & ~matched
+        values[hit] = colorNumber
+        matched |= hit
+    return values
+
 #Reads the next writable glyphs from the line of text and returns the sprites
 def readSpritesFromText(line, wordList, wordCoords, fontList, imageList, currentFont, startPoint, fontHeight, TPNs):
     
@@ -1683,21 +2042,12 @@ def modifyANM(ANMFilePath, ANMOffset, scriptFilePath, wordList, wordCoords, font
                 seq = ANMObj.sequences[currentSequence]
 
 
-                retainedSprites = []
                 if len(keeps) > 0:
-                    for keepID in keeps:
-                        retainedSprites.append(ANMObj.spriteGroups[seq.spriteGrpNumber].sprites[keepID])
-                    ANMObj.spriteGroups[seq.spriteGrpNumber].sprites = retainedSprites
-                    ANMObj.spriteGroups[seq.spriteGrpNumber].NSprite = len(retainedSprites) 
+                    ANMObj.spriteGroups[seq.spriteGrpNumber].keepSprites(keeps)
                 elif len(drops) > 0:
-                    for i in range(len(ANMObj.spriteGroups[seq.spriteGrpNumber].sprites)):
-                        if i not in drops:
-                            retainedSprites.append(ANMObj.spriteGroups[seq.spriteGrpNumber].sprites[i])
-                    ANMObj.spriteGroups[seq.spriteGrpNumber].sprites = retainedSprites
-                    ANMObj.spriteGroups[seq.spriteGrpNumber].NSprite = len(retainedSprites) 
+                    ANMObj.spriteGroups[seq.spriteGrpNumber].dropSprites(drops)
                 else:
-                    ANMObj.spriteGroups[seq.spriteGrpNumber].sprites = []#Clear Sprite group for new injection
-                    ANMObj.spriteGroups[seq.spriteGrpNumber].NSprite = 0 #
+                    ANMObj.spriteGroups[seq.spriteGrpNumber].keepSprites([])#Clear Sprite group for new injection
 
             elif currentSequence != -1:
                 
@@ -1708,65 +2058,67 @@ def modifyANM(ANMFilePath, ANMOffset, scriptFilePath, wordList, wordCoords, font
                 #nSprites = len(spriteGroup)
                 #currentNSprites += nSprites
 
-                for sprite in nextSprites:
-                    ANMObj.spriteGroups[sequence.spriteGrpNumber].sprites.append(sprite)
-                    ANMObj.spriteGroups[sequence.spriteGrpNumber].NSprite += 1
+                ANMObj.spriteGroups[sequence.spriteGrpNumber].appendSprites(nextSprites)
                     
 
     #Jingle cats has reserved flag set to 1 for first sprite of each sequence because ???
     if GAME_NAME == "Jingle Cats":
         for sequence in ANMObj.sequences:
             spriteGrp = ANMObj.spriteGroups[sequence.spriteGrpNumber]
-            spriteGrp.sprites[0].Flag2Reserve = 1
+            spriteGrp.sprites.Flag2Reserve[0] = 1
                 
 
     return ANMObj
 
 #inserts the data into slot fileNumber and returns the bytes object
 def editPAC(filePath, fileNumber, data):
-    file = open(filePath, 'rb')
-    
-    outputBuffer = b''
-    filesContained = readInt(file) #read first int, numFiles
-    outputBuffer += filesContained.to_bytes(4, byteorder='little')
-    
-    offsets = []
-    datas = []
+    pacArchive = PacArchive(filePath, writable=True)
 
-    for x in range(filesContained):
-        file.seek((x + 1)*4)
-        offset = readInt(file)
-        offsets.append(offset)
+    #Same sized entries are patched in place without rebuilding the PAC
+    if pacArchive.writeEntry(fileNumber, data):
+        outputBuffer = pacArchive.data[:]
+        pacArchive.close()
+        ImageHill.invalidateCache(filePath)
+        return outputBuffer
 
+    filesContained = len(pacArchive)
+    datas = []
     for x in range(filesContained):
-        file.seek(offsets[x])
-        
-        if x != filesContained - 1:
-            fileSize = offsets[x + 1] - offsets[x]
-            filedata = file.read(fileSize)
-        else:
-            filedata = file.read()
-
-        datas.append(filedata)
-
+        datas.append(pacArchive.getEntry(x))
     datas[fileNumber] = data
-    currentSize = (4*(filesContained + 1))
-    outputBuffer += currentSize.to_bytes(4, byteorder='little')#write First entry
 
-    for dataNumber in range(len(datas) - 1):
-        outputBuffer += (currentSize + len(datas[dataNumber])).to_bytes(4, byteorder='little')
-        currentSize += len(datas[dataNumber])
-    
+    offsetTable = [filesContained]
+    currentSize = (4*(filesContained + 1))
     for dataNumber in range(len(datas)):
-        outputBuffer += datas[dataNumber]
+        offsetTable.append(currentSize)
+        currentSize += len(datas[dataNumber])
+
+    outputBuffer = struct.pack('<' + str(len(offsetTable)) + 'I', *offsetTable) + b''.join(datas)
 
-    file.close()
+    datas.clear()
+    pacArchive.close()
     outputFile = open(filePath, 'wb')
     outputFile.write(outputBuffer)
     outputFile.close()
+    ImageHill.invalidateCache(filePath)
 
     return outputBuffer
 
+#Replaces a PAC entry with an ANM object, packing it straight into the mapped PAC when the size is unchanged
+def editPACANM(filePath, fileNumber, ANM):
+    pacArchive = PacArchive(filePath, writable=True)
+    start, end = pacArchive.getEntryBounds(fileNumber)
+    if getANMSize(ANM) == end - start:
+        repackANM_into(ANM, pacArchive.data, start)
+        pacArchive.data.flush()
+        pacArchive.close()
+        ImageHill.invalidateCache(filePath)
+        return
+
+    pacArchive.close()
+    editPAC(filePath, fileNumber, repackANM(ANM))
+    return
+
 #Adds the text in the text file to the corresponding insertion images for ANM, and returns the ANM object, and the widths remaining in the injection areas
 def injectText(ANMFilePath, ANMOffsets, images, TPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath, perLetter = False, kerning = 0):
     #targetImages = []
@@ -1777,14 +2129,22 @@ def injectText(ANMFilePath, ANMOffsets, images, TPNs, insertionAreas, fontImageP
     
     #Load font image and read parameters
     fontImage = Image.open(fontImagePath).convert("RGBA")
-    injectionPixels = []
-    for areaNumber  in range(len(insertionAreas)):
 
-        width = insertionAreas[areaNumber][1][0] - insertionAreas[areaNumber][0][0]
-        height = insertionAreas[areaNumber][1][1] - insertionAreas[areaNumber][0][1]
-        for y in range(height):
-            for x in range(width):
-                injectionPixels.append([x + insertionAreas[areaNumber][0][0], y + insertionAreas[areaNumber][0][1], 0, areaNumber])
+    #One index plane and write mask per target image, areas go to the first image with their TPN
+    ImageTPNs = [image[2] for image in images]
+    planes = []
+    masks = []
+    for image in images:
+        PXLOffset, PMode, imageWidth, imageHeight = readImageEditHeader(image[0], image[1])
+        planes.append(np.zeros((imageHeight, imageWidth), dtype=np.uint32))
+        masks.append(np.zeros((imageHeight, imageWidth), dtype=bool))
+    areaImages = [ImageTPNs.index(TPNs[areaNumber]) for areaNumber in range(len(insertionAreas))]
+
+    #Clear the insertion areas
+    for areaNumber  in range(len(insertionAreas)):
+        areaImage = areaImages[areaNumber]
+        areaY, areaX = np.mgrid[insertionAreas[areaNumber][0][1]:insertionAreas[areaNumber][1][1], insertionAreas[areaNumber][0][0]:insertionAreas[areaNumber][1][0]]
+        setEditPixels(planes[areaImage], masks[areaImage], areaX, areaY, 0)
 
     
 
@@ -1805,8 +2165,9 @@ def injectText(ANMFilePath, ANMOffsets, images, TPNs, insertionAreas, fontImageP
 
     #Insertion area number, X, Y, letter bounds list for word
     wordCoords = arrangeTextIntoImage(wordList, insertionAreas, fontImage, numColumns, fontHeight, tableFilePath, fontCLUT, kerning)
+    glyphAtlas = getGlyphAtlas(fontImagePath, fontCLUT, numColumns, fontHeight)
     
-    #Iterate over word objects, copying each letter to target area
+    #Iterate over word objects, copying each word to target area
     for coordNumber in range(len(wordCoords)):
         insertionAreaNumber = wordCoords[coordNumber][0]
         wordX = wordCoords[coordNumber][1]
@@ -1814,35 +2175,14 @@ def injectText(ANMFilePath, ANMOffsets, images, TPNs, insertionAreas, fontImageP
         letterBounds = wordCoords[coordNumber][3]
 
         word = wordList[coordNumber]
+        if len(word) == 0:
+            continue
 
-        
-        positionInWordX = 0
-        for letterIndex in range(len(word)):
-            letterNumber = letterTable.index(word[letterIndex])
-            letterTileWidth = fontImage.width//numColumns
-            letterXStart = (letterNumber % numColumns) * letterTileWidth 
-            letterYStart = (letterNumber//numColumns)* fontHeight
-            
-            letterTopLeft = letterXStart+ letterBounds[letterIndex][0], letterYStart
-            letterBottomRight = letterXStart + letterBounds[letterIndex][1], letterYStart + fontHeight
-            
-            
-            #Iterate over all pixels in range
-            for y in range(letterBottomRight[1] - letterTopLeft[1]):
-                for x in range(letterBottomRight[0] - letterTopLeft[0] + 1):
-                    fontPixel = fontImage.getpixel((letterTopLeft[0] + x, letterTopLeft[1] + y))
-                    if fontPixel[3] == 0:
-                        fontPixel = (0,0,0,0)
-
-                    if fontPixel not in fontCLUT:
-                        PXLvalue = 0
-                    else:
-                        PXLvalue = fontCLUT.index(fontPixel)
-                    assert PXLvalue >= 0, "Font pixel " + str(x) + "," + str(y) + " is undefined in CLUT!"
-                    injectionPixels.append([wordX + x + positionInWordX, wordY + y, PXLvalue, insertionAreaNumber])
-            positionInWordX += letterBottomRight[0] - letterTopLeft[0] + 1
+        letterNumbers = [letterTable.index(letter) for letter in word]
+        areaImage = areaImages[insertionAreaNumber]
+        blitEditPlane(planes[areaImage], masks[areaImage], wordX, wordY, glyphAtlas.getWord(letterNumbers, letterBounds))
 
-    applyImageEdit(injectionPixels, images, TPNs)
+    applyImageEdit(planes, masks, images)
 
     #Generate ANMs
     ANMs = []
@@ -1853,63 +2193,92 @@ def injectText(ANMFilePath, ANMOffsets, images, TPNs, insertionAreas, fontImageP
 
 
 def findANMOffsets(ANMFile):
-    ANM_ID = 0x40000321
-
-    offsets = []
     ANMFile.seek(0, os.SEEK_END)
-    size = ANMFile.tell()
-    ANMFile.seek(0)
-    for word in range(size//4):
-        readWord = readInt(ANMFile)
-        if readWord == ANM_ID:
-            offsets.append(word*4)
-
+    if ANMFile.tell() == 0:
+        return []
+
+    with mmap.mmap(ANMFile.fileno(), 0, access=mmap.ACCESS_READ) as ANMData:
+        return findSignatureOffsets(ANMData)[ANM_ID]
+
+#Returns True if the image block (bnum, DX, DY, W, H, data) at offset has a size matching its dimensions and fits in data
+def isValidImageBlock(data, offset):
+    if offset + 12 > len(data):
+        return False
+    bnum, DX, DY, W, H = struct.unpack_from('<IHHHH', data, offset)
+    return W > 0 and H > 0 and bnum == 12 + 2 * W * H and offset + bnum <= len(data)
+
+#Returns True if the header found at offset is plausible for its signature, used to drop false positives
+def isValidSignature(data, offset, signature):
+    if signature == ANM_ID:
+        if offset + 8 > len(data):
+            return False
+        NSPRITEGp, NSEQUENCE = struct.unpack_from('<HH', data, offset + 4)
+        return offset + 8 + 8 * NSEQUENCE + 4 * NSPRITEGp <= len(data)
+
+    if offset + 8 > len(data):
+        return False
+    flag = struct.unpack_from('<I', data, offset + 4)[0]
+    if signature in (PXL_ID, CLT_ID):
+        return flag & ~0b11 == 0 and isValidImageBlock(data, offset + 8)
+
+    if signature == TIM_ID:
+        if flag & ~0b1111 != 0 or flag & 0b111 > TWENTYFOUR_BIT_CLUT + 1:
+            return False
+        blockOffset = offset + 8
+        if flag & 0b1000:
+            if not isValidImageBlock(data, blockOffset):
+                return False
+            blockOffset += struct.unpack_from('<I', data, blockOffset)[0]
+        return isValidImageBlock(data, blockOffset)
+
+    return True
+
+#Returns {signature: [offsets]} for every header word in a bytes like buffer (bytes, mmap or memoryview) in one pass
+#Hits are word aligned unless unaligned is set, validate drops hits whose headers do not fit their counts and sizes
+def findSignatureOffsets(data, signatures = (ANM_ID,), unaligned = False, validate = True):
+    signatures = list(signatures)
+    offsets = {signature: [] for signature in signatures}
+
+    for alignment in range(4 if unaligned else 1):
+        wordCount = (len(data) - alignment) // 4
+        if wordCount <= 0:
+            continue
+        words = np.frombuffer(data, dtype='<u4', count=wordCount, offset=alignment)
+        hits = np.flatnonzero(np.isin(words, np.array(signatures, dtype=np.uint32)))
+        for hit in hits.tolist():
+            signature = int(words[hit])
+            offset = hit * 4 + alignment
+            if not validate or isValidSignature(data, offset, signature):
+                offsets[signature].append(offset)
+
+    for signature in signatures:
+        offsets[signature].sort()
     return offsets
 
 
-def unpackBGDCEL(CELs, BGDs, PXLs, CLTs):
+def unpackBGDCEL(CELs, BGDs, PXLs, CLTs, vramIndex = None):
+    if vramIndex is None:
+        vramIndex = VRAMIndex(PXLs, CLTs)
+    for overlapLine in vramIndex.getOverlapReport():
+        print(overlapLine)
+
     cellImages = []
     for cel in CELs:
         for cellNumber in range(cel.NCELL):
             
-            #Find correct PXL match
-            PXLFound = False
-            for pxl in PXLs:
-                BANK_WIDTH = 64
-                SHELF_WIDTH = 16
-                SHELF_HEIGHT = 256
-                pxlDX = pxl.DX
-                pxlDY = pxl.DY
-
-                shelfNumber = cel.CELLS[cellNumber].TPN // SHELF_WIDTH
-
-                if shelfNumber == 0:
-                    spriteDY = 0
-                elif shelfNumber == 1:
-                    spriteDY = SHELF_HEIGHT
-
-                spriteDX = (cel.CELLS[cellNumber].TPN % SHELF_WIDTH) * BANK_WIDTH
-
-                
-                spriteIsInRangeX = spriteDX >= pxl.DX and spriteDX < (pxl.DX + pxl.W)
-                spriteIsInRangeY = spriteDY >= pxl.DY and spriteDY < (pxl.DY + pxl.H)
-
-                if spriteIsInRangeX and spriteIsInRangeY:
-                    pxlMatch = pxl
-                    PXLFound = True
-                    break
+            #Find correct PXL match, a missing page keeps the previous match
+            PXLFound = vramIndex.findPXL(cel.CELLS[cellNumber].TPN) is not None
+            if PXLFound:
+                pxlMatch = vramIndex.findPXL(cel.CELLS[cellNumber].TPN)
             
-            #Find correct CLT match
-            clutFound = False
-            for searchCLUT in CLTs:
-                # %20?
-                trueCLUTX = 0x10 *(cel.CELLS[cellNumber].CLX % 20) - searchCLUT.DX
-                trueCLUTY = cel.CELLS[cellNumber].CLY - searchCLUT.DY
-
-                if trueCLUTX < searchCLUT.W and trueCLUTY < searchCLUT.H and trueCLUTX >= 0 and trueCLUTY >= 0:
-                    #Correct CLUT found
-                    clutFound = True
-                    break
+            #Find correct CLT match, falling back to the last CLT
+            # %20?
+            searchCLUT = vramIndex.findCLT(cel.CELLS[cellNumber].CLX % 20, cel.CELLS[cellNumber].CLY)
+            clutFound = searchCLUT is not None
+            if not clutFound:
+                searchCLUT = CLTs[-1]
+            trueCLUTX = 0x10 *(cel.CELLS[cellNumber].CLX % 20) - searchCLUT.DX
+            trueCLUTY = cel.CELLS[cellNumber].CLY - searchCLUT.DY
             
             if searchCLUT.PMODE == FOUR_BIT_CLUT:
                 clutNumber = trueCLUTY + trueCLUTX
@@ -1947,59 +2316,60 @@ def unpackBGDCEL(CELs, BGDs, PXLs, CLTs):
 #Updates the given ANI file and returns the new and old ANM file offsets 
 def updateANI(ANMs, offsets, ANMFilePath):
     '''Edits the ANM files within an ANI package, given some ANM objects and their original offsets'''
-    ANMstartID = "21030040"
-    
-
     #Find offsets of original file
     originalFilePath = os.path.join(HAR_ORIGINAL_FOLDER,ANMFilePath.split('/', 1)[1])
-    ANIdataOriginal = open(originalFilePath, 'rb').read().hex()
-    intSplitsOriginal = re.findall('.'*8, ANIdataOriginal) #split file into 4 byte words for matching ANM start IDs
-    ANMstartOffsetsOriginal = [i*4 for i, x in enumerate(intSplitsOriginal) if (x == ANMstartID)]
-    #for offset in ANMstartOffsetsOriginal: #Remove non-aligned matches
-    #    if offset % 4 != 0:
-    #        ANMstartOffsetsOriginal.remove(offset)
-
-    #Add each ANM to package one by one
-    for ANMnumber in range(len(ANMs)):
-        originalOffset = offsets[ANMnumber]
-        ANIindex = ANMstartOffsetsOriginal.index(originalOffset)
-        
-        #Find offsets of modified file
-        ANIdata = open(ANMFilePath, 'rb').read().hex()
-        intSplits = re.findall('.'*8, ANIdata) #split file into 4 byte words for matching ANM start IDs
-        ANMstartOffsets = [i*4 for i, x in enumerate(intSplits) if (x == ANMstartID)]
-        #for offset in ANMstartOffsets: #Remove non-aligned matches
-        #    if offset % 4 != 0:
-        #        ANMstartOffsets.remove(offset)
-
-        targetOffset = ANMstartOffsets[ANIindex]
-
-        header = ANIdata[0:targetOffset*2]
-        if ANIindex == len(ANMstartOffsets) - 1:
-            #Add anm obj to last entry
-            footer = ''
-        else:
-            #Add anm obj to not last entry
-            footer = ANIdata[ANMstartOffsets[ANIindex + 1]*2:]
+    ANMstartOffsetsOriginal = findSignatureOffsets(open(originalFilePath, 'rb').read())[ANM_ID]
 
-        
-        
-        newData = bytes.fromhex(header) + repackANM(ANMs[ANMnumber]) + bytes.fromhex(footer)
+    #Map each ANM to its entry number in the package, a later ANM for the same entry wins
+    replacements = {}
+    for ANMnumber in range(len(ANMs)):
+        replacements[ANMstartOffsetsOriginal.index(offsets[ANMnumber])] = ANMs[ANMnumber]
 
-        outFile = open(ANMFilePath, 'wb')
-        outFile.write(newData)
-        outFile.close()
+    ANIdata = open(ANMFilePath, 'rb').read()
+    newData, ANMstartOffsets = rebuildANI(ANIdata, findSignatureOffsets(ANIdata)[ANM_ID], replacements)
 
-        
-    ANIdata = open(ANMFilePath, 'rb').read().hex()
-    intSplits = re.findall('.'*8, ANIdata) #split file into 4 byte words for matching ANM start IDs
-    ANMstartOffsets = [i*4 for i, x in enumerate(intSplits) if (x == ANMstartID)]
-    #for offset in ANMstartOffsets: #Remove non-aligned matches
-    #    if offset % 4 != 0:
-    #        ANMstartOffsets.remove(offset)
+    outFile = open(ANMFilePath, 'wb')
+    outFile.write(newData)
+    outFile.close()
+    ImageHill.invalidateCache(ANMFilePath)
 
     return ANMstartOffsets, ANMstartOffsetsOriginal
 
+def rebuildANI(ANIdata, ANMstartOffsets, replacements):
+    '''Returns an ANI package with the ANM entries in replacements (entry number to ANM object or bytes) swapped in, and its new ANM offsets'''
+    if len(ANMstartOffsets) == 0:
+        return bytearray(ANIdata), []
+
+    #Each entry runs to the start of the next one, the last runs to the end of the package
+    entryBounds = list(zip(ANMstartOffsets, ANMstartOffsets[1:] + [len(ANIdata)]))
+    entrySizes = []
+    for entryNumber, (start, end) in enumerate(entryBounds):
+        replacement = replacements.get(entryNumber)
+        if replacement is None:
+            entrySizes.append(end - start)
+        elif isinstance(replacement, ANM):
+            entrySizes.append(getANMSize(replacement))
+        else:
+            entrySizes.append(len(replacement))
+
+    newData = bytearray(ANMstartOffsets[0] + sum(entrySizes))
+    newData[:ANMstartOffsets[0]] = ANIdata[:ANMstartOffsets[0]]
+
+    newOffsets = []
+    cursor = ANMstartOffsets[0]
+    for entryNumber, (start, end) in enumerate(entryBounds):
+        newOffsets.append(cursor)
+        replacement = replacements.get(entryNumber)
+        if replacement is None:
+            newData[cursor:cursor + entrySizes[entryNumber]] = ANIdata[start:end]
+        elif isinstance(replacement, ANM):
+            repackANM_into(replacement, newData, cursor)
+        else:
+            newData[cursor:cursor + entrySizes[entryNumber]] = replacement
+        cursor += entrySizes[entryNumber]
+
+    return newData, newOffsets
+
 
 def updateHarmfulParkOffsets(ANMFilePath, newOffsets, oldOffsets):
     '''Updates the given ANI file offsets for a given ANI file in the Harmful Park EXE'''
@@ -2065,9 +2435,12 @@ def getCLUTentries(clsPath, clutNumber, doprint = False):
     stringBuffer = "["
 
     entries = readCLTEntries(clsFile, 0x10)
+    palette = decodeCLTEntries(entries)
 
-    for entry in entries:
-        stringBuffer += "(" + str(entry[0] << 3) + ", " + str(entry[1] << 3) + ", " + str(entry[2] << 3) + ", " + str(entry[3] << 3) + "), "
+    for entryNumber in range(len(entries)):
+        red, green, blue = palette[entryNumber][:3]
+        STP = int(entries[entryNumber]) >> 15
+        stringBuffer += "(" + str(red) + ", " + str(green) + ", " + str(blue) + ", " + str(STP << 3) + "), "
     stringBuffer += "]"
 
     if doprint:
@@ -2079,23 +2452,35 @@ def getAnmNumbers(anmPath, offsets):
     anmPath = anmPath.replace("working", "orig")
 
     numbers = []
-    allNumbers = []
-    anmFile = open(anmPath, "rb")
-
-    tableSize = int.from_bytes(anmFile.read(4), "little")
-    anmFile.seek(0)
-
-    for t in range(tableSize):
-        anmFile.seek(4 + t*4)
-        allNumbers.append(int.from_bytes(anmFile.read(4), "little"))
+    with PacArchive(anmPath) as anmArchive:
+        allNumbers = anmArchive.offsets
 
     for offset in offsets:
         numbers.append(allNumbers.index(offset))
 
     return numbers
 
+#Runs injectText and writes the new ANMs into their PAC, skipped when the manifest shows no input or output changed
+def injectTextJob(jobName, manifest, anmNumbers, ANMFilePath, offsets, images, TPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath, perLetter = False, kerning = 0):
+    inputs = textFilePaths + [tableFilePath, fontImagePath]
+    outputs = [ANMFilePath] + sorted(set(image[0] for image in images))
+    parameters = [offsets, images, TPNs, insertionAreas, fontCLUT, perLetter, kerning]
+    if manifest is not None and manifest.isUpToDate(jobName, inputs, outputs, parameters):
+        print("Skipping " + jobName + ", nothing changed since the last injection")
+        return
+
+    newANMs = injectText(ANMFilePath, offsets, images, TPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath, perLetter = perLetter, kerning = kerning)
+    
+    if anmNumbers is None:
+        anmNumbers = getAnmNumbers(ANMFilePath, offsets)
+    for anmID in range(len(newANMs)):
+        editPACANM(ANMFilePath, anmNumbers[anmID], newANMs[anmID])
+
+    if manifest is not None:
+        manifest.record(jobName, manifest.getJobRecord(inputs, outputs, parameters))
+    return
 
-def injectGuideText():
+def injectGuideText(manifest = None):
     images = [["PS1_Base_Project/cd/working/ANM/GUID_PXL.PAC",0xC, 7],  ["PS1_Base_Project/cd/working/ANM/GUID_PXL.PAC",0x8020, 8]]
     #targetImagePaths = ["PS1_Base_Project/cd/working/ANM/GUID_PXL.PAC",
     #                    "PS1_Base_Project/cd/working/ANM/GUID_PXL.PAC",
@@ -2113,14 +2498,11 @@ def injectGuideText():
     tableFilePath = "table.txt"
     ANMFilePath = "PS1_Base_Project/cd/working/ANM/GUID_ANS.PAC"
     offsets = [0xC]
-    newANMs = injectText(ANMFilePath, offsets, images, insertionAreaTPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath)
-    
-
-    editPAC(ANMFilePath, 0, repackANM(newANMs[0]))
+    injectTextJob("injectGuideText", manifest, [0], ANMFilePath, offsets, images, insertionAreaTPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath)
 
     return
 
-def injectBigText():
+def injectBigText(manifest = None):
     images_noTPN = [["PS1_Base_Project/cd/working/ANM/PIX.PAC", 0x20070]]
     images = []
     for image in images_noTPN:
@@ -2141,15 +2523,11 @@ def injectBigText():
     tableFilePath = "tableBig.txt"
     ANMFilePath = "PS1_Base_Project/cd/working/ANM/ANM.PAC"
     offsets = [10724, 11004, 11184, 11364, 11580, 11776]
-    newANMs = injectText(ANMFilePath, offsets, images, insertionAreaTPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath, perLetter=True)
-    
-    anm_numbers = getAnmNumbers(ANMFilePath, offsets)
-    for anmID in range(len(newANMs)):
-        editPAC(ANMFilePath, anm_numbers[anmID], repackANM(newANMs[anmID]))
+    injectTextJob("injectBigText", manifest, None, ANMFilePath, offsets, images, insertionAreaTPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath, perLetter=True)
 
     return
 
-def injectOptionsText():
+def injectOptionsText(manifest = None):
     images_noTPN = [["PS1_Base_Project/cd/working/SZGRP/OPT_PXL.PAC", 0x18054]]
     images = []
     for image in images_noTPN:
@@ -2172,11 +2550,7 @@ def injectOptionsText():
     tableFilePath = "table.txt"
     ANMFilePath = "PS1_Base_Project/cd/working/SZGRP/OPT_ANS.PAC"
     offsets = [5736]
-    newANMs = injectText(ANMFilePath, offsets, images, insertionAreaTPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath, perLetter=True)
-    
-    anm_numbers = getAnmNumbers(ANMFilePath, offsets)
-    for anmID in range(len(newANMs)):
-        editPAC(ANMFilePath, anm_numbers[anmID], repackANM(newANMs[anmID]))
+    injectTextJob("injectOptionsText/OPT", manifest, None, ANMFilePath, offsets, images, insertionAreaTPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath, perLetter=True)
 
     ###################
         
@@ -2189,10 +2563,7 @@ def injectOptionsText():
     insertionAreaTPNs = [images[0][2],images[0][2],images[0][2]]
     ANMFilePath = "PS1_Base_Project/cd/working/SZSYSTEM/SAV_ANS.PAC"
     offsets = [3516]
-    newANMs = injectText(ANMFilePath, offsets, images, insertionAreaTPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath, perLetter=True)
-    anm_numbers = getAnmNumbers(ANMFilePath, offsets)
-    for anmID in range(len(newANMs)):
-        editPAC(ANMFilePath, anm_numbers[anmID], repackANM(newANMs[anmID]))
+    injectTextJob("injectOptionsText/SAV", manifest, None, ANMFilePath, offsets, images, insertionAreaTPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath, perLetter=True)
 
     ######################
 
@@ -2205,13 +2576,10 @@ def injectOptionsText():
     insertionAreaTPNs = [images[0][2],images[0][2],images[0][2]]
     ANMFilePath = "PS1_Base_Project/cd/working/SZSYSTEM/LOD_ANS.PAC"
     offsets = [3516]
-    newANMs = injectText(ANMFilePath, offsets, images, insertionAreaTPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath, perLetter=True)
-    anm_numbers = getAnmNumbers(ANMFilePath, offsets)
-    for anmID in range(len(newANMs)):
-        editPAC(ANMFilePath, anm_numbers[anmID], repackANM(newANMs[anmID]))
+    injectTextJob("injectOptionsText/LOD", manifest, None, ANMFilePath, offsets, images, insertionAreaTPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath, perLetter=True)
     return
 
-def injectFailText():
+def injectFailText(manifest = None):
     images_noTPN = [["PS1_Base_Project/cd/working/ANM/FAIL_PXL.PAC",0x8]]
     images = []
     for image in images_noTPN:
@@ -2227,15 +2595,12 @@ def injectFailText():
     tableFilePath = "table.txt"
     ANMFilePath = "PS1_Base_Project/cd/working/ANM/FAIL_ANS.PAC"
     offsets = [32]
-    newANMs = injectText(ANMFilePath, offsets, images, insertionAreaTPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath)
-    
-
-    editPAC(ANMFilePath, 0, repackANM(newANMs[0]))
+    injectTextJob("injectFailText", manifest, [0], ANMFilePath, offsets, images, insertionAreaTPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath)
 
     return
 
 
-def injectFailText():
+def injectFailText(manifest = None):
     images_noTPN = [["PS1_Base_Project/cd/working/ANM/FAIL_PXL.PAC",0x8]]
     images = []
     for image in images_noTPN:
@@ -2251,14 +2616,11 @@ def injectFailText():
     tableFilePath = "table.txt"
     ANMFilePath = "PS1_Base_Project/cd/working/ANM/FAIL_ANS.PAC"
     offsets = [32]
-    newANMs = injectText(ANMFilePath, offsets, images, insertionAreaTPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath)
-    
-
-    editPAC(ANMFilePath, 0, repackANM(newANMs[0]))
+    injectTextJob("injectFailText", manifest, [0], ANMFilePath, offsets, images, insertionAreaTPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath)
 
     return
 
-def injectSelectText():
+def injectSelectText(manifest = None):
     images_noTPN = [["PS1_Base_Project/cd/working/SZGRP/SEL0_PXL.PAC",0x18058], ["PS1_Base_Project/cd/working/SZGRP/SEL0_PXL.PAC",0x28080], ["PS1_Base_Project/cd/working/SZGRP/SEL0_PXL.PAC",0x1C], ["PS1_Base_Project/cd/working/SZGRP/SEL0_PXL.PAC",0x2006c]]
     images = []
     for image in images_noTPN:
@@ -2276,11 +2638,7 @@ def injectSelectText():
     ANMFilePath = "PS1_Base_Project/cd/working/SZGRP/SEL_ANS.PAC"
     offsets = [12152, 19912, 28788, 4180]
     #offsets = [12152, 28788, 4180]
-    newANMs = injectText(ANMFilePath, offsets, images, insertionAreaTPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath, kerning = 1)
-    
-    anm_numbers = getAnmNumbers(ANMFilePath, offsets)
-    for anmID in range(len(newANMs)):
-        editPAC(ANMFilePath, anm_numbers[anmID], repackANM(newANMs[anmID]))
+    injectTextJob("injectSelectText", manifest, None, ANMFilePath, offsets, images, insertionAreaTPNs, insertionAreas, fontImagePath, fontCLUT, textFilePaths, tableFilePath, kerning = 1)
 
     #editPAC(ANMFilePath, 0, repackANM(newANMs[0]))
 
@@ -2306,7 +2664,7 @@ def testInjectTextTIM():
     ANMFilePath = "PS1_Base_Project/cd/working/ANM/GUID_ANS.PAC"
     offset = 0xC
     newANM = injectText(ANMFilePath, offset, BNOs, insertionAreaBNOIndices, insertionAreas, fontImagePath, fontCLUT, textFilePath, tableFilePath)
-    editPAC(ANMFilePath, 0, repackANM(newANM))
+    editPACANM(ANMFilePath, 0, newANM)
 
     return
 
@@ -2314,38 +2672,38 @@ def testInjectTextTIM():
 
 def getPXLs(filepath):
     pxls = []
-    pxl_file = open(filepath, "rb")
-
-    n_pxls = readInt(pxl_file)
 
-    for n in range(n_pxls):
-        pxl_file.seek(4 + 4*n)
-        pxl_offset = readInt(pxl_file)
-        pxl_file.seek(pxl_offset)
-        pxls.append(PXL(pxl_file))
+    with PacArchive(filepath) as pxlArchive:
+        for n in range(len(pxlArchive)):
+            pxls.append(ImageHill.getCached(filepath, pxlArchive.offsets[n], "PXL", lambda: readPXLBuffer(pxlArchive.getEntry(n))))
 
     return pxls
 
 def getPXL(filepath):
-    gotPxl = PXL(open(filepath, "rb"))
+    gotPxl = ImageHill.getCached(filepath, 0, "PXL", lambda: PXL(open(filepath, "rb")))
     return gotPxl
 
+#Returns the CLT at the given offset of a CLS file, decoded once per process
+def getCLT(filepath, offset = 0):
+    def loadCLT():
+        CLSFile = open(filepath, "rb")
+        CLSFile.seek(offset)
+        gotCLT = CLT(CLSFile)
+        CLSFile.close()
+        return gotCLT
+
+    return ImageHill.getCached(filepath, offset, "CLT", loadCLT)
+
 def getANMs(filepath):
     anms = []
-    anm_file = open(filepath, "rb")
 
-    n_anms = readInt(anm_file)
-
-    for n in range(n_anms):
-        anm_file.seek(4 + 4*n)
-        anm_offset = readInt(anm_file)
-        #anm_file.seek(anm_offset)
-        anms.append(readANM(anm_file, anm_offset))
+    with PacArchive(filepath) as anmArchive:
+        for anm_offset in anmArchive.offsets:
+            anms.append(parseANM(anmArchive.view, anm_offset, os.path.basename(anmArchive.path)))
 
     return anms
 
 
-
 def testANMReading():
     #PXLFile1 = open("PS1_Base_Project/cd/working/ANM/GUID_PXL.PAC", "rb")
     #PXLFile1.seek(0x8020)
@@ -2353,11 +2711,11 @@ def testANMReading():
     #PXLFile0.seek(0xC)
 
     pxls = getPXLs("PS1_Base_Project/cd/working/ANM/GUID_PXL.PAC")
-    CLSFile = open("PS1_Base_Project/cd/working/ANM/P00.CLS", "rb")
+    CLSPath = "PS1_Base_Project/cd/working/ANM/P00.CLS"
     #clut = readCLTEntries(CLSFile, 0x200)
     anms = getANMs("PS1_Base_Project/cd/working/ANM/GUID_ANS.PAC")
     for anm in anms:
-        animateANM(anm, pxls , [CLT(CLSFile)])
+        animateANM(anm, pxls , [getCLT(CLSPath)])
 
 
 
@@ -2365,13 +2723,13 @@ def testANMReading2():
     pxls = getPXLs("PS1_Base_Project/cd/working/SZGRP/SEL0_PXL.PAC")
     pxls = pxls + getPXLs("PS1_Base_Project/cd/working/SZGRP/SEL1_PXL.PAC") + getPXLs("PS1_Base_Project/cd/working/SZGRP/OPT_PXL.PAC")
     #CLSFile = open("PS1_Base_Project/cd/working/SZGRP/COMMON.CLS", "rb")
-    CLSFile = open("COMMON_ADJ.CLS", "rb")
-    CLSFile1 = open("PS1_Base_Project/cd/working/SZGRP/OPT.CLS", "rb")
-    CLSFile2 = open("PS1_Base_Project/cd/working/SZGRP/TTL.CLS", "rb")
+    CLSPath = "COMMON_ADJ.CLS"
+    CLSPath1 = "PS1_Base_Project/cd/working/SZGRP/OPT.CLS"
+    CLSPath2 = "PS1_Base_Project/cd/working/SZGRP/TTL.CLS"
     #clut = readCLTEntries(CLSFile, 0x200)
     anms = getANMs("PS1_Base_Project/cd/working/SZGRP/SEL_ANS.PAC")
 
-    cluts = [CLT(CLSFile)]
+    cluts = [getCLT(CLSPath)]
     for anm in anms:
         animateANM(anm, pxls, cluts)
 
@@ -2383,13 +2741,13 @@ def testANMReading3():
     pxls = pxls + [getPXL("PS1_Base_Project/cd/orig/ANM/GUID_PXL1.PXL")]
     pxls = pxls + [getPXL("PS1_Base_Project/cd/orig/ANM/GUID_PXL2.PXL")]
     #CLSFile = open("PS1_Base_Project/cd/working/SZGRP/COMMON.CLS", "rb")
-    CLSFile = open("P00.CLS", "rb")
+    CLSPath = "P00.CLS"
     #CLSFile1 = open("PS1_Base_Project/cd/working/SZGRP/OPT.CLS", "rb")
     #CLSFile2 = open("PS1_Base_Project/cd/working/SZGRP/TTL.CLS", "rb")
     #clut = readCLTEntries(CLSFile, 0x200)
     anms = getANMs("PS1_Base_Project/cd/orig/ANM/GUID_ANS.PAC")
 
-    cluts = [CLT(CLSFile)]
+    cluts = [getCLT(CLSPath)]
     for anm in anms:
         animateANM(anm, pxls, cluts)
 
@@ -2401,11 +2759,11 @@ def testANMReading4():
     pxls = pxls + [getPXL("PS1_Base_Project/cd/orig/ANM/GUID_PXL2.PXL")]
     pxls = pxls + getPXLs("PS1_Base_Project/cd/orig/ANM/BOX_PXL.PAC")
     pxls = pxls + getPXLs("PS1_Base_Project/cd/orig/ANM/PIX.PAC")
-    CLSFile = open("P00.CLS", "rb")
-    CLSFile2 = open("COMMON_ADJ.CLS", "rb")
+    CLSPath = "P00.CLS"
+    CLSPath2 = "COMMON_ADJ.CLS"
     anms = getANMs("PS1_Base_Project/cd/orig/ANM/FAIL_ANS.PAC")
 
-    cluts = [CLT(CLSFile), CLT(CLSFile2)]
+    cluts = [getCLT(CLSPath), getCLT(CLSPath2)]
     for anm in anms:
         animateANM(anm, pxls, cluts)
 
@@ -2416,11 +2774,11 @@ def testANMReadingS():
     pxls = pxls + [getPXL("PS1_Base_Project/cd/orig/ANM/GUID_PXL2.PXL")]
     pxls = pxls + getPXLs("PS1_Base_Project/cd/orig/ANM/BOX_PXL.PAC")
     pxls = pxls + getPXLs("PS1_Base_Project/cd/working/ANM/PIX.PAC")
-    CLSFile = open("P00.CLS", "rb")
-    CLSFile2 = open("COMMON_ADJ.CLS", "rb")
+    CLSPath = "P00.CLS"
+    CLSPath2 = "COMMON_ADJ.CLS"
     anms = getANMs("PS1_Base_Project/cd/working/ANM/ANM.PAC")
 
-    cluts = [CLT(CLSFile), CLT(CLSFile2)]
+    cluts = [getCLT(CLSPath), getCLT(CLSPath2)]
     for anm in anms:
         animateANM(anm, pxls, cluts)
 
@@ -2429,11 +2787,11 @@ def testANMReadingO():
 
     pxls = getPXLs("PS1_Base_Project/cd/orig/SZGRP/OPT_PXL.PAC")
 
-    CLSFile = open("PS1_Base_Project/cd/orig/SZGRP/OPT.CLS", "rb")
+    CLSPath = "PS1_Base_Project/cd/orig/SZGRP/OPT.CLS"
 
     anms = getANMs("PS1_Base_Project/cd/orig/SZGRP/OPT_ANS.PAC")
 
-    cluts = [CLT(CLSFile)]
+    cluts = [getCLT(CLSPath)]
     for anm in anms:
         animateANM(anm, pxls, cluts)
 
@@ -2442,12 +2800,12 @@ def testANMReadingSave2():
     pxls = getPXLs("PS1_Base_Project/cd/orig/SZSYSTEM/SAV1_PXL.PAC")
     pxls += getPXLs("PS1_Base_Project/cd/orig/SZSYSTEM/SAV0_PXL.PAC")
 
-    CLSFile3 = open("PS1_Base_Project/cd/orig/SZGRP/OPT.CLS", "rb")
-    CLSFile = open("P00.CLS", "rb")
-    CLSFile2 = open("COMMON_ADJ.CLS", "rb")
+    CLSPath3 = "PS1_Base_Project/cd/orig/SZGRP/OPT.CLS"
+    CLSPath = "P00.CLS"
+    CLSPath2 = "COMMON_ADJ.CLS"
     anms = getANMs("PS1_Base_Project/cd/orig/SZSYSTEM/SAV_ANS.PAC")
 
-    cluts = [CLT(CLSFile), CLT(CLSFile2), CLT(CLSFile3)]
+    cluts = [getCLT(CLSPath), getCLT(CLSPath2), getCLT(CLSPath3)]
     for anm in anms:
         animateANM(anm, pxls, cluts)
 
@@ -2456,12 +2814,12 @@ def testANMReadingLoad():
     pxls = getPXLs("PS1_Base_Project/cd/orig/SZSYSTEM/LOD1_PXL.PAC")
     pxls += getPXLs("PS1_Base_Project/cd/orig/SZSYSTEM/LOD0_PXL.PAC")
 
-    CLSFile3 = open("PS1_Base_Project/cd/orig/SZGRP/OPT.CLS", "rb")
-    CLSFile = open("P00.CLS", "rb")
-    CLSFile2 = open("COMMON_ADJ.CLS", "rb")
+    CLSPath3 = "PS1_Base_Project/cd/orig/SZGRP/OPT.CLS"
+    CLSPath = "P00.CLS"
+    CLSPath2 = "COMMON_ADJ.CLS"
     anms = getANMs("PS1_Base_Project/cd/orig/SZSYSTEM/LOD_ANS.PAC")
 
-    cluts = [CLT(CLSFile), CLT(CLSFile2), CLT(CLSFile3)]
+    cluts = [getCLT(CLSPath), getCLT(CLSPath2), getCLT(CLSPath3)]
     for anm in anms:
         animateANM(anm, pxls, cluts)
 
@@ -2476,11 +2834,11 @@ def testANMReading5():
     pxls = pxls + getPXLs("PS1_Base_Project/cd/orig/ANM/BOX_PXL.PAC")
     #pxls = pxls + getPXLs("PS1_Base_Project/cd/orig/ANM/PIX.PAC")
     #pxls = pxls + getPXLs("PS1_Base_Project/cd/orig/ANM/GUID_PXL.PAC")
-    CLSFile = open("P00.CLS", "rb")
-    CLSFile2 = open("COMMON_ADJ.CLS", "rb")
+    CLSPath = "P00.CLS"
+    CLSPath2 = "COMMON_ADJ.CLS"
     anms = getANMs("PS1_Base_Project/cd/orig/ANM/BOX_ANS.PAC")
 
-    cluts = [CLT(CLSFile), CLT(CLSFile2)]
+    cluts = [getCLT(CLSPath), getCLT(CLSPath2)]
     for anm in anms:
         animateANM(anm, pxls, cluts)
 
@@ -2501,11 +2859,11 @@ def testANMReading6():
     #pxls = pxls + getPXLs("PS1_Base_Project/cd/orig/ANM/BOX_PXL.PAC")
     #pxls = pxls + getPXLs("PS1_Base_Project/cd/orig/ANM/PIX.PAC")
     #pxls = pxls + getPXLs("PS1_Base_Project/cd/orig/ANM/GUID_PXL.PAC")
-    CLSFile = open("P00.CLS", "rb")
-    CLSFile2 = open("COMMON_ADJ.CLS", "rb")
+    CLSPath = "P00.CLS"
+    CLSPath2 = "COMMON_ADJ.CLS"
     anms = getANMs("PS1_Base_Project/cd/orig/SZINGAME/FE_ANS.PAC")
 
-    cluts = [CLT(CLSFile), CLT(CLSFile2)]
+    cluts = [getCLT(CLSPath), getCLT(CLSPath2)]
     for anm in anms:
         animateANM(anm, pxls, cluts)
 
@@ -2828,19 +3186,12 @@ def extractCatFrames(framepath, outdir):
 
     return
 
-def injectStockImage(EDIT_PNG_PATH, BASE_PNG_PATH):
+#Injects one edited stock PNG, returns its [job name, manifest record] when a manifest is given and the job ran
+def injectStockImage(EDIT_PNG_PATH, BASE_PNG_PATH, manifest = None):
     
     if filecmp.cmp(EDIT_PNG_PATH, BASE_PNG_PATH):
         return
 
-    print("Injecting STOCK", EDIT_PNG_PATH)
-    baseImage = Image.open(BASE_PNG_PATH)
-    editImage = Image.open(EDIT_PNG_PATH)
-
-    mask = ImageHill.getSkipMask(baseImage, editImage)
-    baseImage.close()
-    editImage.close()
-
     png_name = os.path.basename(EDIT_PNG_PATH)
 
     splitName = png_name.replace(".PNG", "").split("_")
@@ -2888,11 +3239,30 @@ def injectStockImage(EDIT_PNG_PATH, BASE_PNG_PATH):
     clut["N_COLORS"] = n_colors
     clut["CLUT_OFFSET"] = 0x14 + clutNumber*(n_colors*2)
 
+    #The job reads both PNGs and its CLUT, and writes only its own pixel region
+    jobName = os.path.normpath(EDIT_PNG_PATH)
+    inputs = [EDIT_PNG_PATH, BASE_PNG_PATH, [clutPath, clut["CLUT_OFFSET"], n_colors*2]]
+    outputs = [[pxl["PXL_FILE"], pxl["PXL_OFFSET"], width*height*bits//8]]
+    if manifest is not None and manifest.isUpToDate(jobName, inputs, outputs):
+        return
+
+    print("Injecting STOCK", EDIT_PNG_PATH)
+    baseImage = Image.open(BASE_PNG_PATH)
+    editImage = Image.open(EDIT_PNG_PATH)
+
+    mask = ImageHill.getSkipMask(baseImage, editImage)
+    baseImage.close()
+    editImage.close()
+
     ImageHill.injectImage(pxl, clut, EDIT_PNG_PATH, skipmask=mask)
 
+    if manifest is not None:
+        return [jobName, manifest.getJobRecord(inputs, outputs)]
     return
 
-def injectStocks(EDIT_PNG_FOLDER, BASE_PNG_FOLDER):
+#Returns the edited stock PNGs as {PXL file path : [[edit PNG path, base PNG path], ...]}
+def getStockGroups(EDIT_PNG_FOLDER, BASE_PNG_FOLDER):
+    stockGroups = {}
     for overlay_folder_name in os.listdir(EDIT_PNG_FOLDER):
         overlay_folder_path = os.path.join(EDIT_PNG_FOLDER, overlay_folder_name)
         for pacName in os.listdir(overlay_folder_path):
@@ -2900,13 +3270,51 @@ def injectStocks(EDIT_PNG_FOLDER, BASE_PNG_FOLDER):
             if not pacName.upper().endswith(".PAC"):
                 continue
             
+            pxlFilePath = os.path.normpath(os.path.join(SOURCE_FOLDER, overlay_folder_name, pacName))
             for pngFileName in os.listdir(pacFolderPath):
                 if not pngFileName.upper().endswith(".PNG"):
                     continue
                 editPngPath = os.path.join(pacFolderPath, pngFileName)
                 basePNGPath = editPngPath.replace(EDIT_PNG_FOLDER, BASE_PNG_FOLDER)
-                injectStockImage(editPngPath, basePNGPath)
-            
+                stockGroups.setdefault(pxlFilePath, []).append([editPngPath, basePNGPath])
+    return stockGroups
+
+#Injects every stock PNG that targets one PXL file, returns the file path, PNG count, time taken and new manifest records
+def injectStockGroup(pxlFilePath, stockPNGs, manifest = None):
+    startTime = time.perf_counter()
+    records = []
+    for editPngPath, basePNGPath in stockPNGs:
+        record = injectStockImage(editPngPath, basePNGPath, manifest)
+        if record is not None:
+            records.append(record)
+    return pxlFilePath, len(stockPNGs), time.perf_counter() - startTime, records
+
+#Injects all stock PNGs, running PAC files in parallel across workers processes. Each PAC file is only written by one worker
+#With a manifest, PNGs whose inputs and pixel region are unchanged since the last run are skipped
+def injectStocks(EDIT_PNG_FOLDER, BASE_PNG_FOLDER, workers = 1, manifest = None):
+    startTime = time.perf_counter()
+    stockGroups = getStockGroups(EDIT_PNG_FOLDER, BASE_PNG_FOLDER)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            timings = list(pool.map(injectStockGroup, stockGroups.keys(), stockGroups.values(), [manifest]*len(stockGroups)))
+    else:
+        timings = [injectStockGroup(pxlFilePath, stockPNGs, manifest) for pxlFilePath, stockPNGs in stockGroups.items()]
+
+    #Workers only read the manifest, records are merged and saved here
+    if manifest is not None:
+        for timing in timings:
+            for jobName, record in timing[3]:
+                manifest.record(jobName, record, save = False)
+        manifest.save()
+
+    print("Stock injection summary:")
+    for pxlFilePath, nPNGs, elapsed, records in sorted(timings, key=lambda timing: timing[2], reverse=True):
+        summaryLine = "  " + pxlFilePath + ": " + str(nPNGs) + " PNGs in " + "{:.2f}".format(elapsed) + "s"
+        if manifest is not None:
+            summaryLine += ", " + str(len(records)) + " injected"
+        print(summaryLine)
+    print("  Total: " + "{:.2f}".format(time.perf_counter() - startTime) + "s")
     return
 
 VIDEO_NAMES = ["ENDING", "COMP", "OPEN"]
@@ -15,12 +15,13 @@ def build():
     
 
     os.chdir("..")
-    ImageProcessor.injectSelectText()
-    ImageProcessor.injectStocks("STOCK_IMAGES", "STOCK_IMAGES_ORIGINAL")
-    ImageProcessor.injectFailText()
-    ImageProcessor.injectOptionsText()
-    ImageProcessor.injectGuideText()
-    ImageProcessor.injectBigText()
+    manifest = ImageProcessor.BuildManifest()
+    ImageProcessor.injectSelectText(manifest)
+    ImageProcessor.injectStocks("STOCK_IMAGES", "STOCK_IMAGES_ORIGINAL", workers=os.cpu_count(), manifest=manifest)
+    ImageProcessor.injectFailText(manifest)
+    ImageProcessor.injectOptionsText(manifest)
+    ImageProcessor.injectGuideText(manifest)
+    ImageProcessor.injectBigText(manifest)
     
     
 
@@ -36,4 +37,6 @@ def build():
 
     VideoHill.replaceAllPS1Video(r"mkpsxiso/JC.bin", FMV_PATHS, INDICES)
 
-build()
\ No newline at end of file
+#Worker processes re-import this file, so only build when run directly
+if __name__ == "__main__":
+    build()
\ No newline at end of file